@@ -0,0 +1,149 @@
+"""Offline load test of the SaxoAuthService login and refresh flows, on a mock server.
+
+Every session logs in through the full (headless) browser flow, after which worker
+threads call refresh() on the sessions as fast as they can. Refresh latency percentiles,
+the number of refresh calls and token requests per second, and the number of failed
+refreshes are reported.
+
+    python benchmark_refresh.py --sessions 50 --threads 32 --refreshes 5000
+    python benchmark_refresh.py --sessions 50 --latency 0.01 --error-rate 0.01
+"""
+
+import argparse
+import logging
+import statistics
+import sys
+import threading
+import time
+import webbrowser
+from typing import Dict, List
+
+from mock_auth_server import MockAuthServer
+from models import GrantType
+from openapi_client import create_session
+from saxo_auth_service import SaxoAuthService
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+def login_sessions(
+    server: MockAuthServer, sessions: int, grant_type: GrantType, pool_size: int
+) -> tuple[List[SaxoAuthService], List[float]]:
+    """Log in all sessions and return the login latencies.
+
+    Sessions are logged in one at a time, as they share the redirect url.
+    """
+
+    # all sessions share one pooled session, like the sessions of a TokenManager
+    session = create_session(pool_size)
+
+    services = []
+    latencies = []
+    webbrowser.open_new = server.open_browser  # type: ignore[assignment]
+    for _ in range(sessions):
+        service = SaxoAuthService(server.app_config(grant_type), session=session)
+        start = time.perf_counter()
+        service.login(timeout=10)
+        latencies.append(time.perf_counter() - start)
+        services.append(service)
+    return services, latencies
+
+
+def refresh_sessions(
+    services: List[SaxoAuthService], threads: int, refreshes: int
+) -> Dict[str, float]:
+    latencies: List[float] = []
+    failures = 0
+    lock = threading.Lock()
+    counter = iter(range(refreshes))
+
+    def worker() -> None:
+        nonlocal failures
+        for i in counter:
+            service = services[i % len(services)]
+            start = time.perf_counter()
+            try:
+                service.refresh()
+            except RuntimeError:
+                with lock:
+                    failures += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "refreshes": len(latencies),
+        "failures": failures,
+        "elapsed": elapsed,
+        "refreshes_per_second": len(latencies) / elapsed,
+        "mean": statistics.mean(latencies),
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--refreshes", type=int, default=2000)
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="token endpoint latency (s)"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--pkce", action="store_true", help="use the PKCE grant type")
+    args = parser.parse_args()
+
+    # the auth service logs every request at debug level
+    logging.getLogger().setLevel(logging.WARNING)
+
+    server = MockAuthServer(latency=args.latency, error_rate=args.error_rate, seed=42)
+    server.start()
+    try:
+        grant_type = GrantType.PKCE if args.pkce else GrantType.CODE
+        # logins are not subject to the error rate, so every session can be logged in
+        error_rate, server.error_rate = server.error_rate, 0.0
+        services, login_latencies = login_sessions(
+            server, args.sessions, grant_type, args.threads
+        )
+        server.error_rate = error_rate
+        print(
+            f"{args.sessions} logins: "
+            f"{statistics.mean(login_latencies) * 1e3:.1f} ms mean, "
+            f"{max(login_latencies) * 1e3:.1f} ms max"
+        )
+
+        token_requests = server.token_requests
+        result = refresh_sessions(services, args.threads, args.refreshes)
+        token_requests = server.token_requests - token_requests
+    finally:
+        server.shutdown()
+
+    print(
+        f"{result['refreshes']:.0f} refreshes ({result['failures']:.0f} failed) "
+        f"in {result['elapsed']:.2f} s: "
+        f"{result['refreshes_per_second']:,.0f} refreshes/s, "
+        f"{token_requests / result['elapsed']:,.0f} token requests/s"
+    )
+    print(
+        f"refresh latency: {result['mean'] * 1e3:.2f} ms mean, "
+        f"{result['p50'] * 1e3:.2f} ms p50, {result['p95'] * 1e3:.2f} ms p95, "
+        f"{result['p99'] * 1e3:.2f} ms p99"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import base64
+import hashlib
+import json
+import logging
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, NamedTuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+from models import GrantType, OpenAPIAppConfig, copy_model, parse_model
+
+logging.getLogger()
+
+
+class _Client(NamedTuple):
+    grant_type: GrantType
+    client_secret: str | None
+
+
+class _AuthCode(NamedTuple):
+    client_id: str
+    redirect_uri: str
+    code_challenge: str | None
+
+
+class MockAuthServer(threading.Thread):
+    """Local stand-in for Saxo SSO, to run the login and refresh flows offline.
+
+    Implements the authorize endpoint (which immediately redirects to the redirect url
+    with a code) and the token endpoint with the authorization_code (Code and PKCE) and
+    refresh_token grants. Like Saxo SSO, codes and refresh tokens can only be used once.
+
+    Every request to the token endpoint is delayed by latency seconds, and fails with a
+    500 response with probability error_rate.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        expires_in: int = 1200,
+        refresh_token_expires_in: int = 3600,
+        seed: int | None = None,
+    ):
+        threading.Thread.__init__(self, daemon=True)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.expires_in = expires_in
+        self.refresh_token_expires_in = refresh_token_expires_in
+
+        self.token_requests = 0
+        self.errors = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._clients: Dict[str, _Client] = {}
+        self._codes: Dict[str, _AuthCode] = {}
+        self._refresh_tokens: Dict[str, str] = {}  # refresh token -> client id
+
+        self.server = _MockHTTPServer((host, port), _make_request_handler(self))
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        # the address is typed as str or bytes, an AF_INET server always uses str
+        if isinstance(host, bytes):
+            host = host.decode()
+        return f"http://{host}:{port}"
+
+    def run(self) -> None:
+        logging.debug(f"mock auth server listening on {self.url}...")
+        self.server.serve_forever(poll_interval=0.1)
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def app_config(
+        self,
+        grant_type: GrantType = GrantType.CODE,
+        redirect_urls: List[str] | None = None,
+    ) -> OpenAPIAppConfig:
+        """Register a new app with the mock server and return its app config."""
+
+        client_id = secrets.token_hex(16)
+        client_secret = secrets.token_hex(16) if grant_type is GrantType.CODE else None
+        if redirect_urls is None:
+            redirect_urls = [
+                (
+                    "http://localhost:12321/redirect"
+                    if grant_type is GrantType.CODE
+                    else "http://localhost/redirect"
+                )
+            ]
+        self._clients[client_id] = _Client(grant_type, client_secret)
+
+        app_config = parse_model(
+            OpenAPIAppConfig,
+            {
+                "AppName": f"Mock App {client_id[:8]}",
+                "GrantType": grant_type.value,
+                "AppKey": client_id,
+                "AppSecret": client_secret,
+                "AuthorizationEndpoint": "https://localhost/authorize",
+                "TokenEndpoint": "https://localhost/token",
+                "OpenApiBaseUrl": "https://localhost/openapi/",
+                "RedirectUrls": redirect_urls,
+            },
+        )
+        # the endpoints of the mock server are plain http, which the app config rejects
+        return copy_model(
+            app_config,
+            {
+                "auth_endpoint": f"{self.url}/authorize",
+                "token_endpoint": f"{self.url}/token",
+            },
+        )
+
+    @staticmethod
+    def open_browser(url: str) -> None:
+        """Replacement for webbrowser.open_new, follows the url in the background."""
+
+        threading.Thread(target=requests.get, args=(url,), daemon=True).start()
+
+    def authorize(self, args: Dict[str, str]) -> str:
+        """Issue a code and return the url of the callback."""
+
+        client = self._clients.get(args.get("client_id", ""))
+        if client is None:
+            error = {"error": "invalid_client", "error_description": "unknown client"}
+            return (
+                f"{args['redirect_uri']}?{urlencode({**error, 'state': args['state']})}"
+            )
+        code = secrets.token_urlsafe(16)
+        with self._lock:
+            self._codes[code] = _AuthCode(
+                args["client_id"], args["redirect_uri"], args.get("code_challenge")
+            )
+        query = urlencode({"code": code, "state": args["state"]})
+        return f"{args['redirect_uri']}?{query}"
+
+    def token(self, args: Dict[str, str]) -> tuple[int, dict]:
+        """Handle a token request, returns the status code and response body."""
+
+        with self._lock:
+            self.token_requests += 1
+            fail = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            with self._lock:
+                self.errors += 1
+            return 500, {"error": "server_error"}
+
+        grant_type = args.get("grant_type")
+        with self._lock:
+            if grant_type == "authorization_code":
+                client_id = self._exercise_code(args)
+            elif grant_type == "refresh_token":
+                client_id = self._refresh_tokens.pop(
+                    args.get("refresh_token", ""), None
+                )
+            else:
+                return 400, {"error": "unsupported_grant_type"}
+            if client_id is None:
+                return 400, {"error": "invalid_grant"}
+
+            refresh_token = secrets.token_urlsafe(32)
+            self._refresh_tokens[refresh_token] = client_id
+
+        return 201, {
+            "access_token": secrets.token_urlsafe(32),
+            "token_type": "Bearer",
+            "expires_in": self.expires_in,
+            "refresh_token": refresh_token,
+            "refresh_token_expires_in": self.refresh_token_expires_in,
+        }
+
+    def _exercise_code(self, args: Dict[str, str]) -> str | None:
+        auth_code = self._codes.pop(args.get("code", ""), None)
+        if auth_code is None or auth_code.client_id != args.get("client_id"):
+            return None
+        client = self._clients[auth_code.client_id]
+        if client.grant_type is GrantType.CODE:
+            if args.get("client_secret") != client.client_secret:
+                return None
+        else:
+            digest = hashlib.sha256(args.get("code_verifier", "").encode()).digest()
+            challenge = base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+            if challenge != auth_code.code_challenge:
+                return None
+        return auth_code.client_id
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    # the default backlog of 5 connections drops connections under load
+    request_queue_size = 256
+
+
+def _make_request_handler(server: MockAuthServer) -> type[BaseHTTPRequestHandler]:
+    class MockAuthRequestHandler(BaseHTTPRequestHandler):
+        # keep connections alive, like Saxo SSO
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if url.path != "/authorize":
+                self.send_error(404)
+                return
+            self.send_response(302)
+            self.send_header("Location", server.authorize(dict(parse_qsl(url.query))))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_POST(self) -> None:
+            url = urlsplit(self.path)
+            if url.path != "/token":
+                self.send_error(404)
+                return
+            # parameters are accepted both in the query string and as form data
+            args = dict(parse_qsl(url.query))
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                args.update(parse_qsl(self.rfile.read(length).decode()))
+            status, response = server.token(args)
+            body = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            pass
+
+    return MockAuthRequestHandler
@@ -1,33 +1,95 @@
 import logging
-import re
 import threading
+from datetime import datetime
 from enum import Enum
-from typing import List, Optional
-
-from flask import Flask
-from pydantic import (
-    AnyHttpUrl,
-    AnyUrl,
-    BaseModel,
-    ConstrainedStr,
-    Field,
-    root_validator,
-)
-from werkzeug.serving import make_server
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+from urllib.parse import parse_qsl, urlsplit
+
+import pydantic
+
+# pydantic 2 (with validators compiled in pydantic-core) is used when it is installed,
+# pydantic 1 otherwise
+PYDANTIC_V2 = pydantic.VERSION.startswith("2.")
+
+if PYDANTIC_V2:
+    from typing import Annotated
+
+    from pydantic import (
+        AnyHttpUrl,
+        AnyUrl,
+        BaseModel,
+        ConfigDict,
+        Field,
+        StringConstraints,
+        TypeAdapter,
+        UrlConstraints,
+        model_validator,
+    )
+
+    ClientId = Annotated[str, StringConstraints(pattern=r"^[a-f0-9]{32}$")]
+    ClientSecret = ClientId
+    HttpsUrl = Annotated[AnyUrl, UrlConstraints(allowed_schemes=["https"])]
+
+    _url_adapter = TypeAdapter(AnyHttpUrl)
+else:
+    import re
+
+    from pydantic import (
+        AnyHttpUrl,
+        AnyUrl,
+        BaseModel,
+        ConstrainedStr,
+        Field,
+        parse_obj_as,
+        root_validator,
+    )
+
+    class ClientId(ConstrainedStr):  # type: ignore[no-redef]
+        regex = re.compile(r"^[a-f0-9]{32}$")
+
+    class ClientSecret(ClientId):  # type: ignore[no-redef]
+        pass
+
+    class HttpsUrl(AnyUrl):  # type: ignore[no-redef]
+        allowed_schemes = {"https"}
+
 
 logging.getLogger()
 
+Model = TypeVar("Model", bound=BaseModel)
 
-class ClientId(ConstrainedStr):
-    regex = re.compile(r"^[a-f0-9]{32}$")
 
+def parse_model(model: Type[Model], obj: Any) -> Model:
+    if PYDANTIC_V2:
+        return model.model_validate(obj)
+    return model.parse_obj(obj)
 
-class ClientSecret(ClientId):
-    pass
 
+def parse_model_json(model: Type[Model], data: str | bytes) -> Model:
+    if PYDANTIC_V2:
+        return model.model_validate_json(data)
+    return model.parse_raw(data)
 
-class HttpsUrl(AnyUrl):
-    allowed_schemes = {"https"}
+
+def model_json(instance: BaseModel) -> str:
+    if PYDANTIC_V2:
+        return instance.model_dump_json()
+    return instance.json()
+
+
+def copy_model(instance: Model, update: Dict[str, Any]) -> Model:
+    """Copy of instance with updated fields, which are not validated."""
+
+    if PYDANTIC_V2:
+        return instance.model_copy(update=update)
+    return instance.copy(update=update)
+
+
+def parse_url(url: str) -> AnyHttpUrl:
+    if PYDANTIC_V2:
+        return _url_adapter.validate_python(url)
+    return parse_obj_as(AnyHttpUrl, url)
 
 
 class GrantType(Enum):
@@ -35,36 +97,59 @@ class GrantType(Enum):
     PKCE = "PKCE"
 
 
+def _validate_redirect_urls(
+    grant_type: GrantType | None, redirect_urls: List[AnyHttpUrl]
+) -> None:
+    # ports are read from the urls as provided, as pydantic 2 fills in the default port
+    ports = [urlsplit(str(url)).port for url in redirect_urls]
+    if grant_type is GrantType.CODE:
+        assert all([port is not None for port in ports]), (
+            "port is required for every redirect url, "
+            "such as http://localhost:4321/redirect"
+        )
+
+    if grant_type is GrantType.PKCE:
+        assert all([port is None for port in ports]), (
+            "port should NOT be specified for every redirect url, "
+            "such as http://localhost/redirect"
+        )
+
+
 class OpenAPIAppConfig(BaseModel):
-    """Dataclass for parsing and validating app config object from Saxo Developer Portal."""
+    """Dataclass to parse and validate an app config object from Saxo Developer Portal.
+
+    App configs are immutable, so a parsed config can be shared by many SaxoAuthService
+    instances.
+    """
 
     app_name: str = Field(..., alias="AppName")
     grant_type: GrantType = Field(..., alias="GrantType")
     client_id: ClientId = Field(..., alias="AppKey")
-    client_secret: ClientSecret = Field(None, alias="AppSecret")
+    client_secret: Optional[ClientSecret] = Field(None, alias="AppSecret")
     auth_endpoint: HttpsUrl = Field(..., alias="AuthorizationEndpoint")
     token_endpoint: HttpsUrl = Field(..., alias="TokenEndpoint")
     api_base_url: HttpsUrl = Field(..., alias="OpenApiBaseUrl")
     redirect_urls: List[AnyHttpUrl] = Field(..., alias="RedirectUrls")
 
-    @root_validator
-    def validate_app_config(cls, values: dict) -> dict:
-        if values.get("grant_type") is GrantType.CODE:
-            assert all(
-                [
-                    url.port is not None
-                    for url in values.get("redirect_urls")  # type:ignore
-                ]
-            ), "port is required for every redirect url, such as http://localhost:4321/redirect"
-
-        if values.get("grant_type") is GrantType.PKCE:
-            print(
-                [url.port is None for url in values.get("redirect_urls")]  # type:ignore
+    if PYDANTIC_V2:
+        model_config = ConfigDict(frozen=True)
+
+        @model_validator(mode="after")
+        def validate_app_config(self) -> "OpenAPIAppConfig":
+            _validate_redirect_urls(self.grant_type, self.redirect_urls)
+            return self
+
+    else:
+
+        class Config:
+            allow_mutation = False
+
+        @root_validator
+        def validate_app_config(cls, values: dict) -> dict:
+            _validate_redirect_urls(
+                values.get("grant_type"), values.get("redirect_urls") or []
             )
-            assert all(
-                [url.port is None for url in values.get("redirect_urls")]  # type:ignore
-            ), "port should NOT be specified for every redirect url, such as http://localhost/redirect"
-        return values
+            return values
 
 
 class AuthTokenData(BaseModel):
@@ -76,26 +161,98 @@ class AuthTokenData(BaseModel):
     base_uri: Optional[str] = None
 
 
+class CachedTokenData(BaseModel):
+    """Token data persisted by TokenStore, with the wall clock expiry of both tokens."""
+
+    client_id: str
+    token_data: AuthTokenData
+    access_token_expires_at: datetime
+    refresh_token_expires_at: datetime
+    redirect_url: Optional[str] = None
+    code_verifier: Optional[str] = None
+
+
+class RedirectServerBackend(Enum):
+    HTTP_SERVER = "http.server"
+    FLASK = "Flask"
+
+
+# called with the query parameters of the callback, returns the text for the browser
+CallbackHandler = Callable[[Dict[str, str]], str]
+
+
 class RedirectServer(threading.Thread):
     """
-    This Flask server runs inside a thread, and will be terminated when the callback is received.
+    This server runs inside a thread, and will be terminated when the callback is
+    received.
+
+    By default the server is built on http.server from the standard library. Flask
+    (which takes considerably longer to import) is only imported when the FLASK backend
+    is selected.
     """
 
-    def __init__(self, app: Flask, redirect_url: AnyHttpUrl):
+    def __init__(
+        self,
+        handle_callback: CallbackHandler,
+        redirect_url: AnyHttpUrl,
+        backend: RedirectServerBackend = RedirectServerBackend.HTTP_SERVER,
+    ):
         threading.Thread.__init__(self, daemon=True)
         host = redirect_url.host
-        port = redirect_url.port
-        self.server = make_server(host, port, app)  # type: ignore[arg-type]
-        self.ctx = app.app_context()
-        self.ctx.push()
+        port = int(redirect_url.port)  # type: ignore[arg-type]
+        if backend is RedirectServerBackend.FLASK:
+            self.server = _make_flask_server(
+                host, port, redirect_url.path, handle_callback  # type: ignore[arg-type]
+            )
+        else:
+            handler = _make_request_handler(
+                redirect_url.path, handle_callback  # type: ignore[arg-type]
+            )
+            self.server = HTTPServer((host, port), handler)  # type: ignore[arg-type]
 
     def run(self) -> None:
         logging.debug("starting server and listening for callback from Saxo...")
-        self.server.serve_forever()
+        self.server.serve_forever(poll_interval=0.1)
 
     def shutdown(self) -> None:
         logging.debug("terminating server...")
         self.server.shutdown()
+        self.server.server_close()
+
+
+def _make_request_handler(
+    path: str, handle_callback: CallbackHandler
+) -> type[BaseHTTPRequestHandler]:
+    class CallbackRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if url.path != path:
+                self.send_error(404)
+                return
+            body = handle_callback(dict(parse_qsl(url.query))).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            logging.info(f"{self.address_string()} - {format % args}")
+
+    return CallbackRequestHandler
+
+
+def _make_flask_server(
+    host: str, port: int, path: str, handle_callback: CallbackHandler
+) -> HTTPServer:
+    from flask import Flask, request
+    from werkzeug.serving import make_server
+
+    app = Flask(__name__)
+    app.add_url_rule(
+        path, "handle_callback", lambda: handle_callback(request.args.to_dict())
+    )
+    return make_server(host, port, app)
 
 
 app_config = {
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    from saxo_auth_service import SaxoAuthService
+
+logging.getLogger()
+
+
+def create_session(pool_size: int = 10, max_retries: int = 3) -> requests.Session:
+    """Create a requests Session that keeps up to pool_size connections per host alive.
+
+    Failed connections are retried, as well as idempotent requests that return 429 or
+    5xx gateway errors.
+    """
+
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class OpenAPIClient:
+    """Sends requests to Saxo OpenAPI with the access token of a SaxoAuthService.
+
+    Paths are relative to the OpenApiBaseUrl of the app config, for example:
+    client.get("port/v1/users/me")
+    """
+
+    def __init__(self, auth_service: SaxoAuthService, session: requests.Session):
+        self._auth_service = auth_service
+        self._session = session
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        headers = kwargs.pop("headers", {})
+        headers["Authorization"] = f"Bearer {self._auth_service.access_token}"
+        response = self._session.request(
+            method,
+            f"{self._auth_service.api_base_url}{path.lstrip('/')}",
+            headers=headers,
+            **kwargs,
+        )
+        # The X-Correlation header should be logged at every request! Only with this ID
+        # Saxo can help troubleshooting issues.
+        # https://openapi.help.saxo/hc/en-us/articles/4434784593309
+        logging.debug(
+            f"{method} {path} returned {response.status_code} "
+            f"(X-Correlation: {response.headers.get('x-correlation')})"
+        )
+        return response
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("DELETE", path, **kwargs)
@@ -1,5 +1,3 @@
-import requests
-
 from saxo_auth_service import SaxoAuthService, parse_app_config
 
 app_config = {
@@ -21,10 +19,7 @@ print(f"{saxo_auth.logged_in=}")
 
 print(saxo_auth.access_token)
 
-response = requests.get(
-    url=f"{saxo_auth.api_base_url}port/v1/users/me",
-    headers={"Authorization": f"Bearer {saxo_auth.access_token}"},
-)
+response = saxo_auth.client.get("port/v1/users/me")
 print(response.json())
 
 saxo_auth.refresh()
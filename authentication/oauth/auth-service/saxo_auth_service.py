@@ -1,19 +1,37 @@
+import asyncio
 import base64
 import hashlib
 import json
 import logging
 import os
 import secrets
+import threading
 import webbrowser
+from datetime import datetime, timedelta, timezone
+from functools import partial
 from random import randint
-from time import sleep
-from typing import List
+from time import monotonic
+from typing import TYPE_CHECKING, Dict, List, Tuple
 from urllib.parse import urlencode
 
 import requests
-from pydantic import AnyHttpUrl, parse_obj_as
+from pydantic import AnyHttpUrl
+
+from models import (
+    AuthTokenData,
+    CachedTokenData,
+    GrantType,
+    HttpsUrl,
+    OpenAPIAppConfig,
+    RedirectServer,
+    RedirectServerBackend,
+    parse_model,
+    parse_url,
+)
+from openapi_client import OpenAPIClient, create_session
 
-from models import AuthTokenData, GrantType, HttpsUrl, OpenAPIAppConfig, RedirectServer
+if TYPE_CHECKING:
+    from token_store import TokenStore
 
 # reduce log level to remove debug messages from console output
 logging.basicConfig(
@@ -32,21 +50,74 @@ class SaxoAuthService:
     _auth_error_message: str | None = None
     _auth_code_verifier: bytes | None = None
 
-    def __init__(self, app_config: OpenAPIAppConfig | None = None):
+    # resolved when the redirect server receives the Saxo SSO callback in login_async()
+    _auth_callback_future: (
+        "tuple[asyncio.AbstractEventLoop, asyncio.Future[None]] | None"
+    ) = None
+
+    # monotonic clock timestamps at which the access and refresh token expire
+    _token_expires_at: float | None = None
+    _refresh_token_expires_at: float | None = None
+
+    def __init__(
+        self,
+        app_config: OpenAPIAppConfig | None = None,
+        auto_refresh: bool = False,
+        refresh_margin: int = 60,
+        pool_size: int = 10,
+        max_retries: int = 3,
+        token_store: "TokenStore | None" = None,
+        redirect_server_backend: RedirectServerBackend = (
+            RedirectServerBackend.HTTP_SERVER
+        ),
+        session: requests.Session | None = None,
+    ):
         """Create a new AuthService object with provided AppConfig.
 
-        When initialized, config is loaded either directly from app_config argument or from "app_config.json".
+        When initialized, config is loaded either directly from app_config argument or
+        from "app_config.json" (see load_app_config()).
+
+        With auto_refresh enabled, a background thread refreshes the access token
+        refresh_margin seconds (at most half the lifetime of the token) before it
+        expires, so reading access_token never has to wait for the token endpoint.
+
+        All requests (to the token endpoint and through the client property) share one
+        pooled session that keeps up to pool_size connections alive, so TLS handshakes
+        are not repeated for every request. Pass a session (see
+        openapi_client.create_session()) to share one pool between multiple services.
+
+        With a token_store, tokens are persisted (encrypted) after every login and
+        refresh. login() then restores the cached session and only opens the browser
+        when the cached refresh token has expired.
+
+        The callback from Saxo SSO is received by a small http.server based server.
+        Flask is only required (and imported) with
+        redirect_server_backend=RedirectServerBackend.FLASK.
         """
 
+        self._token_store = token_store
+        self._redirect_server_backend = redirect_server_backend
+
+        self._session = session or create_session(pool_size, max_retries)
+        self._client = OpenAPIClient(self, self._session)
+
+        self._auto_refresh = auto_refresh
+        self._refresh_margin = refresh_margin
+        self._refresh_lock = threading.Lock()
+        self._token_generation = 0
+        self._refresh_thread: threading.Thread | None = None
+        self._stop_refresh = threading.Event()
+
+        # set when the redirect server receives the callback from Saxo SSO
+        self._auth_callback_event = threading.Event()
+
         if app_config:
             logging.debug("using config directly passed from app_config argument")
             self._app_config = app_config
         else:
             if os.path.isfile("app_config.json"):
                 logging.debug("found config file 'app_config.json'")
-                with open("app_config.json", "r") as config_file:
-                    config_data = json.load(config_file)
-                    self._app_config = parse_app_config(config_data)
+                self._app_config = load_app_config("app_config.json")
             else:
                 raise RuntimeError(
                     "no app config object found - make sure 'app_config.json' is available in this directory or load the config directly when initializing SaxoAuthService"
@@ -54,11 +125,19 @@ class SaxoAuthService:
 
     @property
     def logged_in(self) -> bool:
-        if self._token_data:
-            return True
-        else:
+        """True while the session can be used, i.e. the refresh token is still valid."""
+
+        if not self._token_data:
             return False
-        # if token expired...
+        return monotonic() < self._refresh_token_expires_at  # type: ignore[operator]
+
+    @property
+    def access_token_expires_in(self) -> float:
+        """Seconds until the access token expires (negative if it already expired)."""
+
+        if not self._token_data:
+            return 0
+        return self._token_expires_at - monotonic()  # type: ignore[operator]
 
     @property
     def available_redirect_urls(self) -> List[AnyHttpUrl]:
@@ -72,16 +151,94 @@ class SaxoAuthService:
     def api_base_url(self) -> HttpsUrl:
         return self._app_config.api_base_url
 
+    @property
+    def client(self) -> OpenAPIClient:
+        """Client for OpenAPI requests, which adds the access token to every request."""
+
+        return self._client
+
     @property
     def access_token(self) -> str:
         if not self.logged_in:
             raise ValueError(
                 "you are not logged in currently - use login() to create a new session"
             )
+        # only happens when the token was not refreshed in the background (in time)
+        if self.access_token_expires_in <= 0:
+            logging.debug("access token expired - refreshing before returning it...")
+            self.refresh()
         return self._token_data.access_token  # type: ignore[union-attr]
 
-    def login(self, redirect_url: AnyHttpUrl = None, redirect_port: int = None) -> None:
-        """Create a new API session by authenticating with Saxo SSO."""
+    def login(
+        self,
+        redirect_url: AnyHttpUrl | None = None,
+        redirect_port: int | None = None,
+        timeout: float | None = 300,
+    ) -> None:
+        """Create a new API session by authenticating with Saxo SSO.
+
+        If a token store is configured, the cached session is refreshed instead when
+        possible. Raises a TimeoutError if the user did not complete the login within
+        timeout seconds.
+        """
+
+        if self._token_store and self._login_from_token_store():
+            return
+
+        state, server = self._start_login(redirect_url, redirect_port)
+
+        try:
+            received_callback = self._auth_callback_event.wait(timeout)
+        except KeyboardInterrupt:
+            logging.warning("keyboard interrupt received - shutting down...")
+            server.shutdown()
+            exit(-1)
+
+        if not received_callback:
+            server.shutdown()
+            raise TimeoutError(f"no callback received from Saxo SSO within {timeout}s")
+
+        self._finish_login(state, server)
+
+    async def login_async(
+        self,
+        redirect_url: AnyHttpUrl | None = None,
+        redirect_port: int | None = None,
+        timeout: float | None = 300,
+    ) -> None:
+        """Same as login(), for callers that run an asyncio event loop.
+
+        The event loop is not blocked while waiting for the callback, and blocking
+        requests to the token endpoint are run in the default executor.
+        """
+
+        loop = asyncio.get_running_loop()
+        if self._token_store:
+            if await loop.run_in_executor(None, self._login_from_token_store):
+                return
+
+        callback_future = loop.create_future()
+        self._auth_callback_future = (loop, callback_future)
+        state, server = await loop.run_in_executor(
+            None, partial(self._start_login, redirect_url, redirect_port)
+        )
+
+        try:
+            await asyncio.wait_for(callback_future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            await loop.run_in_executor(None, server.shutdown)
+            if isinstance(error, asyncio.CancelledError):
+                raise
+            raise TimeoutError(f"no callback received from Saxo SSO within {timeout}s")
+        finally:
+            self._auth_callback_future = None
+
+        await loop.run_in_executor(None, self._finish_login, state, server)
+
+    def _start_login(
+        self, redirect_url: AnyHttpUrl | None, redirect_port: int | None
+    ) -> tuple[str, RedirectServer]:
+        """Listen for the callback, and open the browser with the authorization url."""
 
         logging.debug(
             f"logging in to app: '{self._app_config.app_name}' using {self._app_config.grant_type}"
@@ -104,19 +261,15 @@ class SaxoAuthService:
                     1000, 9999
                 )  # any of these ports are usually free
                 _redirect_url = self._app_config.redirect_urls[0]
-                self._auth_redirect_url = parse_obj_as(
-                    AnyHttpUrl,
+                self._auth_redirect_url = parse_url(
                     f"{_redirect_url.scheme}://{_redirect_url.host}:{_redirect_port}{_redirect_url.path}",  # type: ignore[union-attr]
                 )
             else:
-                self._auth_redirect_url = parse_obj_as(
-                    AnyHttpUrl,
+                self._auth_redirect_url = parse_url(
                     f"{redirect_url.scheme}://{redirect_url.host}:{redirect_port}{redirect_url.path}",  # type: ignore[union-attr]
                 )  # type: ignore[union-attr]
 
-        logging.debug(
-            f"redirect url for callback: {self._auth_redirect_url.format()}"  # type: ignore[union-attr]
-        )
+        logging.debug(f"redirect url for callback: {self._auth_redirect_url}")
 
         state = secrets.token_urlsafe(10)
 
@@ -147,19 +300,20 @@ class SaxoAuthService:
             )
 
         auth_url = (
-            self._app_config.auth_endpoint + "?" + urlencode(auth_request_query_params)
+            f"{self._app_config.auth_endpoint}?{urlencode(auth_request_query_params)}"
         )
-        logging.debug(f"browser will be opened with url: {auth_url=}")
-        webbrowser.open_new(auth_url)  # type: ignore[arg-type]
+        # listen before opening the browser, so an immediate redirect can't be missed
+        self._auth_callback_event.clear()
         server = self._create_redirect_server(self._auth_redirect_url)  # type: ignore[arg-type]
         server.start()
 
-        while not self._auth_received_callback:
-            try:
-                sleep(1)
-            except KeyboardInterrupt:
-                logging.warning("keyboard interrupt received - shutting down...")
-                exit(-1)
+        logging.debug(f"browser will be opened with url: {auth_url=}")
+        webbrowser.open_new(auth_url)  # type: ignore[arg-type]
+
+        return state, server
+
+    def _finish_login(self, state: str, server: RedirectServer) -> None:
+        """Validate the received callback and exercise the authorization code."""
 
         server.shutdown()
 
@@ -175,45 +329,120 @@ class SaxoAuthService:
 
         self.exercise_authorization(auth_code=self._auth_code)
 
+    def _login_from_token_store(self) -> bool:
+        """Restore and refresh the session from the token store.
+
+        Returns False if that's not possible.
+        """
+
+        with self._token_store.lock():  # type: ignore[union-attr]
+            cached = self._load_cached_token()
+            if not cached:
+                return False
+            self._restore_cached_token(cached)
+            try:
+                self.exercise_authorization()
+            except (RuntimeError, requests.RequestException) as error:
+                logging.warning(f"could not refresh cached session: {error}")
+                self._token_data = None
+                return False
+
+        logging.debug("session restored from token store - skipping browser login")
+        return True
+
+    def _load_cached_token(self) -> CachedTokenData | None:
+        cached = self._token_store.load()  # type: ignore[union-attr]
+        if not cached or cached.client_id != self._app_config.client_id:
+            return None
+        if cached.refresh_token_expires_at <= datetime.now(timezone.utc):
+            logging.debug("cached refresh token expired")
+            return None
+        return cached
+
+    def _restore_cached_token(self, cached: CachedTokenData) -> None:
+        now = datetime.now(timezone.utc)
+        self._token_data = cached.token_data
+        self._token_expires_at = (
+            monotonic() + (cached.access_token_expires_at - now).total_seconds()
+        )
+        self._refresh_token_expires_at = (
+            monotonic() + (cached.refresh_token_expires_at - now).total_seconds()
+        )
+        if cached.redirect_url:
+            self._auth_redirect_url = parse_url(cached.redirect_url)
+        if cached.code_verifier:
+            self._auth_code_verifier = cached.code_verifier.encode()
+        self._token_generation += 1
+
+    def _save_token(self, token_data: AuthTokenData) -> None:
+        now = datetime.now(timezone.utc)
+        self._token_store.save(  # type: ignore[union-attr]
+            CachedTokenData(
+                client_id=self._app_config.client_id,
+                token_data=token_data,
+                access_token_expires_at=now + timedelta(seconds=token_data.expires_in),
+                refresh_token_expires_at=now
+                + timedelta(seconds=token_data.refresh_token_expires_in),
+                redirect_url=(
+                    str(self._auth_redirect_url) if self._auth_redirect_url else None
+                ),
+                code_verifier=(
+                    self._auth_code_verifier.decode()
+                    if self._auth_code_verifier
+                    else None
+                ),
+            )
+        )
+
     def _create_redirect_server(self, redirect_url: AnyHttpUrl) -> RedirectServer:
-        from flask import Flask, request
+        return RedirectServer(
+            self._handle_callback, redirect_url, self._redirect_server_backend
+        )
 
-        app = Flask(__name__)
+    def _handle_callback(self, args: Dict[str, str]) -> str:
+        """
+        Saxo SSO will redirect to the redirect url after the user authenticates.
+        """
 
-        @app.route(redirect_url.path)  # type: ignore[arg-type]
-        def handle_callback() -> str:
-            """
-            Saxo SSO will redirect to this endpoint after the user authenticates.
-            """
+        logging.debug("received callback")
+        self._auth_received_callback = False
+        self._auth_code = None
+        self._auth_received_state = None
+        self._auth_error_message = None
 
-            logging.debug("received callback")
-            self._auth_received_callback = False
-            self._auth_code = None
-            self._auth_received_state = None
-            self._auth_error_message = None
+        if "error" in args:
+            self._auth_error_message = args["error"]
+            if args.get("error_description"):
+                self._auth_error_message += ": " + args["error_description"]
+        elif not args.get("code"):
+            # a callback without code fails the login right away, instead of timing out
+            self._auth_error_message = "callback did not contain an authorization code"
+        else:
+            self._auth_code = args["code"]
 
-            if "error" in request.args:
-                self._auth_error_message = (
-                    request.args["error"] + ": " + request.args["error_description"]
-                )
-                render_text = (
-                    "Error occurred. Please check the application command line."
-                )
-            else:
-                self._auth_code = request.args["code"]
-                render_text = (
-                    "Authentication succeeded! Please go back to the application."
-                )
+        if self._auth_error_message:
+            render_text = "Error occurred. Please check the application command line."
+        else:
+            render_text = "Authentication succeeded! Please go back to the application."
 
-            self._auth_received_state = request.args["state"]
-            self._auth_received_callback = True
+        self._auth_received_state = args.get("state")
+        self._auth_received_callback = True
 
-            return render_text
+        # wake up the thread or coroutine waiting in login() right away
+        self._auth_callback_event.set()
+        if self._auth_callback_future:
+            loop, future = self._auth_callback_future
+            loop.call_soon_threadsafe(_set_future_done, future)
 
-        return RedirectServer(app, redirect_url)
+        return render_text
 
     def logout(self) -> None:
+        self.stop_auto_refresh()
+        if self._token_store:
+            self._token_store.clear()
         self._token_data = None
+        self._token_expires_at = None
+        self._refresh_token_expires_at = None
         self._auth_redirect_url = None
         self._auth_received_callback = None
         self._auth_code = None
@@ -223,13 +452,78 @@ class SaxoAuthService:
         logging.debug("logout completed")
 
     def refresh(self) -> None:
+        """Refresh the access token using the refresh token.
+
+        Concurrent callers are coalesced: callers that arrive while a refresh is in
+        flight wait for it to complete and use its result, instead of sending another
+        request to the token endpoint.
+        """
+
         if not self.logged_in:
             raise ValueError(
                 "you are not logged in currently - use login() to create a new session"
             )
-        self.exercise_authorization()
-
-    def exercise_authorization(self, auth_code: str = None) -> None:
+        generation = self._token_generation
+        with self._refresh_lock:
+            if generation != self._token_generation:
+                logging.debug("token was refreshed by another caller")
+                return
+            if not self._token_store:
+                self.exercise_authorization()
+                return
+
+            # the refresh token can only be used once, so another process may already
+            # have refreshed it
+            with self._token_store.lock():
+                cached = self._load_cached_token()
+                if (
+                    cached
+                    and cached.token_data.refresh_token
+                    != self._token_data.refresh_token  # type: ignore[union-attr]
+                ):
+                    logging.debug("using token refreshed by another process")
+                    self._restore_cached_token(cached)
+                    return
+                self.exercise_authorization()
+
+    def start_auto_refresh(self) -> None:
+        """Start a background thread that refreshes the access token before expiry."""
+
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        self._stop_refresh.clear()
+        self._refresh_thread = threading.Thread(
+            target=self._auto_refresh_loop, name="saxo-token-refresh", daemon=True
+        )
+        self._refresh_thread.start()
+
+    def stop_auto_refresh(self) -> None:
+        self._stop_refresh.set()
+        if (
+            self._refresh_thread
+            and self._refresh_thread is not threading.current_thread()
+        ):
+            self._refresh_thread.join()
+        self._refresh_thread = None
+
+    def _auto_refresh_loop(self) -> None:
+        logging.debug("starting background token refresh...")
+        while self.logged_in:
+            # a margin longer than the token lifetime would refresh it continuously
+            lifetime = self._token_data.expires_in  # type: ignore[union-attr]
+            margin = min(self._refresh_margin, lifetime / 2)
+            delay = max(self.access_token_expires_in - margin, 0)
+            if self._stop_refresh.wait(delay):
+                break
+            try:
+                self.refresh()
+            except (RuntimeError, requests.RequestException) as error:
+                logging.error(f"background token refresh failed: {error} - retrying...")
+                if self._stop_refresh.wait(max(min(10, margin), 1)):
+                    break
+        logging.debug("background token refresh stopped")
+
+    def exercise_authorization(self, auth_code: str | None = None) -> None:
         """Exercises the provided auth_code, defaults to using the refresh token."""
 
         token_request_params = {}
@@ -280,15 +574,61 @@ class SaxoAuthService:
                     }
                 )
 
-        response = requests.post(
+        response = self._session.post(
             self._app_config.token_endpoint, params=token_request_params
         )
         if response.status_code == 201:
             logging.debug("access & refresh token created/refreshed successfully")
-            self._token_data = AuthTokenData.parse_obj(response.json())
+            token_data = parse_model(AuthTokenData, response.json())
+            self._token_expires_at = monotonic() + token_data.expires_in
+            self._refresh_token_expires_at = (
+                monotonic() + token_data.refresh_token_expires_in
+            )
+            self._token_data = token_data
+            self._token_generation += 1
+            if self._token_store:
+                self._save_token(token_data)
+            if self._auto_refresh:
+                self.start_auto_refresh()
         else:
             raise RuntimeError("error occurred while attempting to retrieve token")
 
 
+def _set_future_done(future: "asyncio.Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+# parsed app configs by sha256 of their content, and by file path (with the mtime and
+# size of the file)
+_app_configs: Dict[str, OpenAPIAppConfig] = {}
+_app_config_files: Dict[str, Tuple[int, int, OpenAPIAppConfig]] = {}
+
+
 def parse_app_config(app_config_object: dict) -> OpenAPIAppConfig:
-    return OpenAPIAppConfig.parse_obj(app_config_object)
+    """Parse and validate an app config object.
+
+    Parsed configs are memoized by content hash, so creating many services from the same
+    config only validates it once.
+    """
+
+    content = json.dumps(app_config_object, sort_keys=True, default=str).encode()
+    key = hashlib.sha256(content).hexdigest()
+    app_config = _app_configs.get(key)
+    if app_config is None:
+        app_config = parse_model(OpenAPIAppConfig, app_config_object)
+        _app_configs[key] = app_config
+    return app_config
+
+
+def load_app_config(path: str = "app_config.json") -> OpenAPIAppConfig:
+    """Load an app config file, only read and parsed again when it changed on disk."""
+
+    stat = os.stat(path)
+    cached = _app_config_files.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(path, "r") as config_file:
+        app_config = parse_app_config(json.load(config_file))
+    _app_config_files[path] = (stat.st_mtime_ns, stat.st_size, app_config)
+    return app_config
@@ -0,0 +1,167 @@
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import requests
+
+from models import OpenAPIAppConfig
+from openapi_client import OpenAPIClient, create_session
+from saxo_auth_service import SaxoAuthService
+
+logging.getLogger()
+
+
+class SessionKey(NamedTuple):
+    app_name: str
+    user: str
+
+
+class TokenManager:
+    """Holds the sessions of many apps and users in one process, and refreshes them.
+
+    Every session is a SaxoAuthService keyed by app name and user. Instead of a refresh
+    thread per session, one scheduler thread tracks when each access token is due for
+    refresh and hands the refreshes to max_concurrency worker threads. A burst of
+    expiring tokens therefore never sends more than max_concurrency concurrent requests
+    to the token endpoint.
+
+    All sessions share one pooled requests Session, and every session has its own
+    authenticated client.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        refresh_margin: int = 60,
+        retry_delay: int = 10,
+        pool_size: int = 10,
+        max_retries: int = 3,
+    ):
+        self._refresh_margin = refresh_margin
+        self._retry_delay = retry_delay
+        self._session = create_session(pool_size, max_retries)
+        self._services: Dict[SessionKey, SaxoAuthService] = {}
+
+        self._executor = ThreadPoolExecutor(
+            max_concurrency, thread_name_prefix="saxo-token-refresh"
+        )
+        # heap of (due time, session key) - entries of removed or rescheduled sessions
+        # are skipped
+        self._schedule: List[Tuple[float, SessionKey]] = []
+        self._due: Dict[SessionKey, float] = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._scheduler = threading.Thread(
+            target=self._run_scheduler, name="saxo-token-scheduler", daemon=True
+        )
+        self._scheduler.start()
+
+    @property
+    def sessions(self) -> List[SessionKey]:
+        return list(self._services)
+
+    def add(
+        self, app_config: OpenAPIAppConfig, user: str, **kwargs: Any
+    ) -> SaxoAuthService:
+        """Add a session for user of the app.
+
+        kwargs are passed on to SaxoAuthService (e.g. token_store).
+        """
+
+        key = SessionKey(app_config.app_name, user)
+        if key in self._services:
+            raise ValueError(f"session already exists for {key}")
+        service = SaxoAuthService(app_config, session=self._session, **kwargs)
+        self._services[key] = service
+        return service
+
+    def get(self, app_name: str, user: str) -> SaxoAuthService:
+        return self._services[SessionKey(app_name, user)]
+
+    def client(self, app_name: str, user: str) -> OpenAPIClient:
+        return self.get(app_name, user).client
+
+    def login(self, app_name: str, user: str, **kwargs: Any) -> None:
+        """Log in the session (see SaxoAuthService.login()) and schedule refreshes."""
+
+        self.get(app_name, user).login(**kwargs)
+        self.schedule(app_name, user)
+
+    def schedule(self, app_name: str, user: str) -> None:
+        """Schedule the next refresh of a logged in session.
+
+        The token is refreshed refresh_margin seconds before it expires.
+        """
+
+        self._schedule_refresh(SessionKey(app_name, user), self.get(app_name, user))
+
+    def remove(self, app_name: str, user: str) -> None:
+        """Log out the session and stop refreshing it."""
+
+        key = SessionKey(app_name, user)
+        with self._condition:
+            service = self._services.pop(key)
+            self._due.pop(key, None)
+        service.logout()
+
+    def close(self) -> None:
+        """Stop the scheduler and wait for refreshes in flight to complete."""
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._scheduler.join()
+        self._executor.shutdown(wait=True)
+
+    def _schedule_refresh(self, key: SessionKey, service: SaxoAuthService) -> None:
+        expires_in = service.access_token_expires_in
+        # never wait less than half the remaining time, a margin longer than the
+        # lifetime of the token would refresh it continuously
+        delay = max(expires_in - self._refresh_margin, expires_in / 2, 0)
+        self._schedule_at(key, monotonic() + delay)
+
+    def _schedule_at(self, key: SessionKey, due: float) -> None:
+        with self._condition:
+            if key not in self._services:
+                return
+            self._due[key] = due
+            heapq.heappush(self._schedule, (due, key))
+            self._condition.notify()
+
+    def _run_scheduler(self) -> None:
+        logging.debug("starting token refresh scheduler...")
+        with self._condition:
+            while not self._stopped:
+                if not self._schedule:
+                    self._condition.wait()
+                    continue
+                due, key = self._schedule[0]
+                delay = due - monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._schedule)
+                if self._due.get(key) != due:
+                    continue
+                del self._due[key]
+                self._executor.submit(self._refresh, key)
+        logging.debug("token refresh scheduler stopped")
+
+    def _refresh(self, key: SessionKey) -> None:
+        service = self._services.get(key)
+        if service is None:
+            return
+        try:
+            service.refresh()
+        except ValueError:
+            logging.warning(f"refresh token of {key} expired - log in again")
+            return
+        except (RuntimeError, requests.RequestException) as error:
+            logging.error(f"token refresh of {key} failed: {error} - retrying...")
+            self._schedule_at(key, monotonic() + self._retry_delay)
+            return
+        # the session may have been removed meanwhile, then it is not scheduled again
+        self._schedule_refresh(key, service)
@@ -0,0 +1,115 @@
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from models import CachedTokenData, model_json, parse_model_json
+
+# sys.platform instead of os.name, so type checkers skip the imports of other platforms
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+logging.getLogger()
+
+
+class TokenStore:
+    """Encrypted on-disk cache of token data, to skip the interactive login on startup.
+
+    The file is encrypted with Fernet (AES + HMAC) using the provided key, or the key in
+    the SAXO_TOKEN_STORE_KEY environment variable. Create a new key with
+    TokenStore.generate_key().
+
+    Access to the file is serialized with a lock file, so multiple processes can share
+    one store. The lock can be held across a load-refresh-save sequence with lock(),
+    which prevents two processes from exercising the same (single-use) refresh token.
+    """
+
+    def __init__(self, path: str, key: bytes | str | None = None):
+        key = key or os.environ.get("SAXO_TOKEN_STORE_KEY")
+        if not key:
+            raise ValueError(
+                "no encryption key provided - pass a key or set SAXO_TOKEN_STORE_KEY "
+                "(see TokenStore.generate_key())"
+            )
+        self.path = path
+        self._fernet = Fernet(key)
+        self._lock_path = path + ".lock"
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file: IO[bytes] | None = None
+
+    @staticmethod
+    def generate_key() -> str:
+        return Fernet.generate_key().decode()
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        """Hold the store lock (reentrant within this process) during the block."""
+
+        with self._thread_lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(self._lock_path, "a+b")
+                _lock_file(self._lock_file)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    _unlock_file(self._lock_file)  # type: ignore[arg-type]
+                    self._lock_file.close()  # type: ignore[union-attr]
+                    self._lock_file = None
+
+    def load(self) -> CachedTokenData | None:
+        """Return the cached token data, or None if there is no (readable) cache."""
+
+        with self.lock():
+            if not os.path.isfile(self.path):
+                return None
+            with open(self.path, "rb") as token_file:
+                encrypted = token_file.read()
+        try:
+            return parse_model_json(CachedTokenData, self._fernet.decrypt(encrypted))
+        except InvalidToken:
+            logging.warning(
+                f"could not decrypt token cache '{self.path}' - ignoring it"
+            )
+            return None
+
+    def save(self, cached_token: CachedTokenData) -> None:
+        encrypted = self._fernet.encrypt(model_json(cached_token).encode())
+        with self.lock():
+            # write to a temporary file first, so readers never see a partial file
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as token_file:
+                token_file.write(encrypted)
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.path)
+        logging.debug(f"token data saved to '{self.path}'")
+
+    def clear(self) -> None:
+        with self.lock():
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+
+def _lock_file(lock_file: IO[bytes]) -> None:
+    if sys.platform == "win32":
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(lock_file: IO[bytes]) -> None:
+    if sys.platform == "win32":
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
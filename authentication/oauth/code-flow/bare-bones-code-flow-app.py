@@ -8,8 +8,6 @@ import webbrowser
 import requests  # https://requests.readthedocs.io doesn't support HTTP/2
 import logging
 
-from time import sleep
-
 from urllib.parse import urlparse
 from flask import Flask, request
 from werkzeug.serving import make_server
@@ -52,7 +50,7 @@ def handle_callback():
     Saxo SSO will redirect to this endpoint after the user authenticates.
     """
 
-    global received_callback, code, error_message, received_state
+    global code, error_message, received_state
     error_message = None
     code = None
 
@@ -64,7 +62,7 @@ def handle_callback():
         render_text = "Authentication succeeded! Please go back to the application."
 
     received_state = request.args["state"]
-    received_callback = True
+    received_callback.set()
 
     return render_text
 
@@ -104,8 +102,11 @@ auth_url = requests.Request(
     "GET", url=app_config["AuthorizationEndpoint"], params=auth_request_params
 ).prepare()
 
-# this variable will flip to 'True' when the Flask server receives a callback from Saxo SSO
-received_callback = False
+# this event is set when the Flask server receives a callback from Saxo SSO
+received_callback = threading.Event()
+
+# seconds the user gets to complete the login in the browser
+LOGIN_TIMEOUT = 300
 
 logging.debug("opening browser and loading authorization URL...")
 webbrowser.open_new(auth_url.url)
@@ -114,17 +115,21 @@ server = ServerThread(app)
 server.start()
 
 # wait for login to be completed by the user, until then listen for redirect
-while not received_callback:
-    try:
-        sleep(1)
-    except KeyboardInterrupt:
-        logging.warning("keyboard interrupt received - shutting down...")
-        server.shutdown()
-        exit(-1)
+try:
+    login_completed = received_callback.wait(LOGIN_TIMEOUT)
+except KeyboardInterrupt:
+    logging.warning("keyboard interrupt received - shutting down...")
+    server.shutdown()
+    exit(-1)
 
-logging.debug("received callback")
 server.shutdown()
 
+if not login_completed:
+    logging.error(f"no callback received within {LOGIN_TIMEOUT} seconds")
+    exit(-1)
+
+logging.debug("received callback")
+
 if state != received_state:
     logging.error("received state does not match original state.")
     exit(-1)
@@ -8,8 +8,6 @@ import requests
 import base64
 import hashlib
 
-from time import sleep
-
 from random import randint
 from urllib.parse import urlparse
 from pprint import pprint
@@ -46,7 +44,7 @@ def handle_callback():
     Saxo SSO will redirect to this endpoint after the user authenticates.
     """
 
-    global received_callback, code, error_message, received_state
+    global code, error_message, received_state
     error_message = None
     code = None
 
@@ -60,7 +58,7 @@ def handle_callback():
         render_text = "Please return to the application."
 
     received_state = r.args["state"]
-    received_callback = True
+    received_callback.set()
 
     return render_text
 
@@ -124,21 +122,27 @@ auth_url = requests.Request(
 
 print("Opening browser and loading authorization URL...")
 
-received_callback = False
+# set when the Flask server receives the callback, the user has LOGIN_TIMEOUT seconds to
+# log in
+received_callback = threading.Event()
+LOGIN_TIMEOUT = 300
 webbrowser.open_new(auth_url.url)
 
 # after authentication in the browser, Saxo SSO will redirect to localhost.
 server = ServerThread(app, urlparse(ad_hoc_redirect), port)
 server.start()
-while not received_callback:
-    try:
-        sleep(0.1)
-    except KeyboardInterrupt:
-        print("Caught keyboard interrupt. Shutting down.")
-        server.shutdown()
-        exit(-1)
+try:
+    login_completed = received_callback.wait(LOGIN_TIMEOUT)
+except KeyboardInterrupt:
+    print("Caught keyboard interrupt. Shutting down.")
+    server.shutdown()
+    exit(-1)
 server.shutdown()
 
+if not login_completed:
+    print(f"No callback received within {LOGIN_TIMEOUT} seconds.")
+    exit(-1)
+
 if state != received_state:
     print("Received state does not match original state.")
     exit(-1)
@@ -0,0 +1,144 @@
+# tested in Python 3.6+
+# required packages: aiohttp
+
+"""Asyncio client for the Saxo OpenAPI REST endpoints used by the streaming samples.
+
+All requests share one aiohttp session with a pool of keep-alive connections, and the
+number of requests in flight is limited by a semaphore. Because nothing blocks the event
+loop, subscriptions can be created and deleted while the websocket reader keeps
+processing frames.
+
+The base url can be pointed at a local stub server, for example
+`http://localhost:8080/openapi/`.
+"""
+
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+from payload_decoder import FORMAT_JSON
+
+SIM_BASE_URL = "https://gateway.saxobank.com/sim/openapi/"
+LIVE_BASE_URL = "https://gateway.saxobank.com/openapi/"
+
+
+class OpenAPIError(RuntimeError):
+    def __init__(self, method: str, url: str, status: int, body: Any):
+        super().__init__(f"{method} {url} returned status {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+class OpenAPIClient:
+    """Asyncio REST client with pooled connections and a limit on concurrent requests.
+
+    Use it as an async context manager, or call `open()` and `close()` from within the
+    event loop.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = SIM_BASE_URL,
+        max_connections: int = 10,
+        max_concurrency: int = 10,
+        timeout: float = 30,
+    ):
+        self.token = token
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self._max_connections = max_connections
+        self._max_concurrency = max_concurrency
+        self._timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "OpenAPIClient":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        if self._session is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._max_connections),
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+            )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(
+        self, method: str, path: str, json: Optional[Dict[str, Any]] = None
+    ) -> Tuple[int, Any]:
+        """Send a request to `base_url + path`, return the status code and decoded body.
+
+        Raises an OpenAPIError for any status code of 400 and up.
+        """
+
+        await self.open()
+        url = self.base_url + path.lstrip("/")
+        headers = {"Authorization": f"Bearer {self.token}"}
+
+        async with self._semaphore:  # type: ignore[union-attr]
+            async with self._session.request(  # type: ignore[union-attr]
+                method, url, headers=headers, json=json
+            ) as response:
+                if response.content_type == "application/json":
+                    body = await response.json()
+                else:
+                    body = await response.text()
+
+        if response.status >= 400:
+            raise OpenAPIError(method, url, response.status, body)
+        return response.status, body
+
+    async def get(self, path: str) -> Any:
+        return (await self.request("GET", path))[1]
+
+    async def post(self, path: str, json: Dict[str, Any]) -> Any:
+        return (await self.request("POST", path, json))[1]
+
+    async def put(self, path: str, json: Dict[str, Any]) -> Any:
+        return (await self.request("PUT", path, json))[1]
+
+    async def delete(self, path: str) -> Any:
+        return (await self.request("DELETE", path))[1]
+
+    async def create_subscription(
+        self,
+        context_id: str,
+        ref_id: str,
+        arguments: Dict[str, Any],
+        payload_format: str = FORMAT_JSON,
+        service: str = "trade/v1/infoprices",
+    ) -> Dict[str, Any]:
+        """Create a subscription and return the response (including the `Snapshot`)."""
+
+        return await self.post(
+            f"{service}/subscriptions",
+            {
+                "Arguments": arguments,
+                "ContextId": context_id,
+                "ReferenceId": ref_id,
+                "Format": payload_format,
+            },
+        )
+
+    async def delete_subscription(
+        self, context_id: str, ref_id: str, service: str = "trade/v1/infoprices"
+    ) -> None:
+        await self.delete(f"{service}/subscriptions/{context_id}/{ref_id}")
+
+    # Only one app is entitled to receive realtime prices. This is handled via the
+    # primary session. More info on keeping the status:
+    # https://saxobank.github.io/openapi-samples-js/websockets/primary-monitoring/
+    async def take_primary_session(self) -> None:
+        await self.put(
+            "root/v1/sessions/capabilities", {"TradeLevel": "FullTradingAndChat"}
+        )
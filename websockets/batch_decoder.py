@@ -0,0 +1,210 @@
+# tested in Python 3.6+
+# required packages: none (orjson and protobuf are used when they are installed)
+
+"""Decoding of all frames of a websocket message in one batch.
+
+`iter_frames()` and `PayloadDecoder.decode()` handle one frame at a time, so every frame
+pays for a Frame tuple, a payload view and a separate call into the JSON decoder. The
+batch decoder instead:
+
+1. scans the whole message once, collecting the header fields and payload offsets of
+   all frames in parallel lists (`FrameIndex`)
+2. decodes the JSON payloads of all frames that are requested in one go: with orjson
+   (when installed) every payload is parsed straight from the message, with the json
+   module the payloads are joined into one string that is converted once and scanned
+   at the offset of every payload
+
+Protobuf payloads are decoded one by one by the PayloadDecoder.
+"""
+
+import json
+import re
+import struct
+from typing import Any, Callable, Container, List, NamedTuple, Optional, Tuple, Union
+
+from frame_parser import (
+    FRAME_HEADER,
+    PAYLOAD_FORMAT_JSON,
+    PAYLOAD_HEADER,
+    Frame,
+    FrameParseError,
+)
+from payload_decoder import PayloadDecodeError, PayloadDecoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+Message = Union[bytes, bytearray, memoryview]
+
+# placeholder for the data of frames that were not decoded (control messages, or not
+# requested)
+NOT_DECODED: Any = object()
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class FrameIndex(NamedTuple):
+    """Header fields of all frames of a message.
+
+    The payload of frame i is message[starts[i]:ends[i]].
+    """
+
+    msg_ids: List[int]
+    ref_ids: List[str]
+    payload_formats: List[int]
+    starts: List[int]
+    ends: List[int]
+
+    def frame(self, message: Message, i: int) -> Frame:
+        return Frame(
+            self.msg_ids[i],
+            self.ref_ids[i],
+            self.payload_formats[i],
+            memoryview(message)[self.starts[i] : self.ends[i]],
+        )
+
+
+def scan_frames(message: Message) -> FrameIndex:
+    """Collect the header fields and payload offsets of every frame in a message."""
+
+    index = FrameIndex([], [], [], [], [])
+    add_msg_id = index.msg_ids.append
+    add_ref_id = index.ref_ids.append
+    add_payload_format = index.payload_formats.append
+    add_start = index.starts.append
+    add_end = index.ends.append
+    unpack_frame_header = FRAME_HEADER.unpack_from
+    unpack_payload_header = PAYLOAD_HEADER.unpack_from
+    frame_header_size = FRAME_HEADER.size
+    payload_header_size = PAYLOAD_HEADER.size
+
+    end = len(message)
+    offset = 0
+    try:
+        while offset < end:
+            msg_id, _version, ref_id_length = unpack_frame_header(message, offset)
+            offset += frame_header_size
+            ref_id = bytes(message[offset : offset + ref_id_length]).decode()
+            offset += ref_id_length
+            payload_format, payload_size = unpack_payload_header(message, offset)
+            offset += payload_header_size
+            if offset + payload_size > end:
+                raise FrameParseError(
+                    f"payload of {payload_size} bytes for '{ref_id}' "
+                    "exceeds message length"
+                )
+            add_msg_id(msg_id)
+            add_ref_id(ref_id)
+            add_payload_format(payload_format)
+            add_start(offset)
+            offset += payload_size
+            add_end(offset)
+    except struct.error:
+        raise FrameParseError(f"truncated frame header at offset {offset}")
+    return index
+
+
+class BatchDecoder:
+    """Decodes the payloads of a whole message at once, see the module docstring.
+
+    `backend` is "orjson" or "json", by default orjson is used when it is installed.
+    """
+
+    def __init__(
+        self, decoder: Optional[PayloadDecoder] = None, backend: Optional[str] = None
+    ):
+        if backend is None:
+            backend = "orjson" if orjson is not None else "json"
+        if backend == "orjson" and orjson is None:
+            raise ImportError("the orjson package is not installed")
+        if backend not in ("orjson", "json"):
+            raise ValueError(f"unknown JSON backend {backend!r}")
+        self.decoder = decoder if decoder is not None else PayloadDecoder()
+        self.backend = backend
+        self._decode_json: Callable[[List[memoryview]], List[Any]] = (
+            self._decode_json_orjson if backend == "orjson" else self._decode_json_batch
+        )
+
+    def decode(
+        self, message: Message, ref_ids: Optional[Container[str]] = None
+    ) -> Tuple[FrameIndex, List[Any]]:
+        """Scan the message and decode the payloads of data frames (of `ref_ids`).
+
+        Returns the frame index and the decoded data per frame. The data is NOT_DECODED
+        for control messages and frames of other reference ids, and a PayloadDecodeError
+        for undecodable payloads.
+        """
+
+        index = scan_frames(message)
+        data: List[Any] = [NOT_DECODED] * len(index.ref_ids)
+        json_frames = []
+        for i, (ref_id, payload_format) in enumerate(
+            zip(index.ref_ids, index.payload_formats)
+        ):
+            if ref_ids is None:
+                if ref_id.startswith("_"):
+                    continue
+            elif ref_id not in ref_ids:
+                continue
+            if payload_format == PAYLOAD_FORMAT_JSON:
+                json_frames.append(i)
+            else:
+                try:
+                    data[i] = self.decoder.decode(index.frame(message, i))
+                except PayloadDecodeError as error:
+                    data[i] = error
+
+        if json_frames:
+            view = memoryview(message)
+            payloads = [view[index.starts[i] : index.ends[i]] for i in json_frames]
+            for i, item in zip(json_frames, self._decode_json(payloads)):
+                data[i] = item
+        return index, data
+
+    def _decode_json_orjson(self, payloads: List[memoryview]) -> List[Any]:
+        loads = orjson.loads
+        decoded: List[Any] = []
+        for payload in payloads:
+            try:
+                decoded.append(loads(payload))
+            except orjson.JSONDecodeError as error:
+                decoded.append(PayloadDecodeError(f"invalid JSON payload: {error}"))
+        return decoded
+
+    def _decode_json_batch(self, payloads: List[memoryview]) -> List[Any]:
+        joined = b"".join(payloads)
+        try:
+            text = str(joined, "utf-8")
+        except ValueError:
+            text = ""
+        # with only ASCII characters the offsets in the text are the payload offsets
+        if text and len(text) == len(joined):
+            scan_once = _JSON_DECODER.scan_once
+            skip_whitespace = _JSON_WHITESPACE.match
+            decoded = []
+            end = 0
+            try:
+                for payload in payloads:
+                    start = skip_whitespace(text, end).end()
+                    end += len(payload)
+                    item, item_end = scan_once(text, start)
+                    # every item has to end exactly where its payload ends, so invalid
+                    # payloads like `1,[2` and `3]` can't be read as one item
+                    if skip_whitespace(text, item_end).end() != end:
+                        break
+                    decoded.append(item)
+                else:
+                    return decoded
+            except (StopIteration, ValueError):
+                pass
+        # a payload is invalid (or not ASCII), decode them one by one
+        decoded = []
+        for payload in payloads:
+            try:
+                decoded.append(json.loads(str(payload, "utf-8")))
+            except ValueError as error:
+                decoded.append(PayloadDecodeError(f"invalid JSON payload: {error}"))
+        return decoded
@@ -0,0 +1,255 @@
+# tested in Python 3.6+
+# required packages: none (protobuf to include protobuf payloads)
+
+"""Offline throughput benchmark of the streaming decoders, with synthetic messages.
+
+Every decoder processes the same set of messages. Frames per second, bytes per second
+and the peak memory allocated while decoding (measured with tracemalloc in a separate
+run) are reported.
+
+Run the benchmark and save the results as baseline:
+
+    python benchmark_decoder.py --save baseline.json
+
+Compare a later run against the baseline - the exit code is 1 when a decoder lost more
+than `--tolerance` of its frames per second, so it can be used to gate performance
+regressions:
+
+    python benchmark_decoder.py --compare baseline.json --tolerance 0.1
+
+Use `--capture capture.bin` to benchmark with messages recorded from a live connection
+(see capture.py) instead of synthetic messages.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from batch_decoder import BatchDecoder, orjson, scan_frames
+from capture import CaptureReader
+from frame_parser import iter_frames, slice_frames
+from metrics import InMemoryMetrics
+from payload_decoder import PayloadDecoder
+from router import MessageRouter
+from synthetic_frames import generate_messages, generate_ref_ids, protobuf_message_class
+
+Decoder = Callable[[bytes], int]
+
+
+def legacy_decode_message(message: bytes) -> int:
+    """The original decoder of the samples (slicing every field), without printing."""
+
+    frames = 0
+    for _, ref_id, payload_format, payload in slice_frames(message):
+        if payload_format == 0 and not ref_id.startswith("_"):
+            json.loads(payload.decode())
+        frames += 1
+    return frames
+
+
+def parse_only(message: bytes) -> int:
+    frames = 0
+    for _ in iter_frames(message):
+        frames += 1
+    return frames
+
+
+def build_decoders(
+    ref_ids: List[str], protobuf_ref_ids: List[str]
+) -> Dict[str, Decoder]:
+    # orjson (when installed), and the json module
+    payload_decoder = PayloadDecoder()
+    json_decoder = PayloadDecoder("json")
+    message_class = protobuf_message_class()
+    for ref_id in protobuf_ref_ids:
+        payload_decoder.register_protobuf(ref_id, message_class)
+        json_decoder.register_protobuf(ref_id, message_class)
+
+    def decode_payloads(message: bytes) -> int:
+        index = scan_frames(message)
+        decode = payload_decoder.decode_payload
+        for ref_id, payload_format, start, end in zip(
+            index.ref_ids, index.payload_formats, index.starts, index.ends
+        ):
+            if ref_id[0] != "_":
+                decode(ref_id, payload_format, message[start:end])
+        return len(index.ref_ids)
+
+    router = MessageRouter(payload_decoder)
+    for ref_id in ref_ids + protobuf_ref_ids:
+        router.register(ref_id, lambda message: None)
+
+    def route(message: bytes) -> int:
+        frames = 0
+        for _ in router.route_message(message):
+            frames += 1
+        return frames
+
+    # the same router, with payloads decoded by the json module instead of orjson
+    json_router = MessageRouter(json_decoder)
+    for ref_id in ref_ids + protobuf_ref_ids:
+        json_router.register(ref_id, lambda message: None)
+
+    def route_json(message: bytes) -> int:
+        frames = 0
+        for _ in json_router.route_message(message):
+            frames += 1
+        return frames
+
+    # the same router, with all metrics recorded
+    instrumented_router = MessageRouter(payload_decoder, metrics=InMemoryMetrics())
+    for ref_id in ref_ids + protobuf_ref_ids:
+        instrumented_router.register(ref_id, lambda message: None)
+
+    def route_with_metrics(message: bytes) -> int:
+        frames = 0
+        for _ in instrumented_router.route_message(message):
+            frames += 1
+        return frames
+
+    # all frames of a message decoded at once, with orjson (when installed) and json
+    batch_decoders = {"json": BatchDecoder(payload_decoder, "json")}
+    if orjson is not None:
+        batch_decoders["orjson"] = BatchDecoder(payload_decoder, "orjson")
+
+    def make_batch_decoder(batch_decoder: BatchDecoder) -> Decoder:
+        def decode_batch(message: bytes) -> int:
+            return len(batch_decoder.decode(message)[0].msg_ids)
+
+        return decode_batch
+
+    batch_router = MessageRouter(
+        payload_decoder, batch_decoder=BatchDecoder(payload_decoder)
+    )
+    for ref_id in ref_ids + protobuf_ref_ids:
+        batch_router.register(ref_id, lambda message: None)
+
+    def route_batch(message: bytes) -> int:
+        frames = 0
+        for _ in batch_router.route_message(message):
+            frames += 1
+        return frames
+
+    decoders: Dict[str, Decoder] = {
+        "parse_only": parse_only,
+        "payload_decoder": decode_payloads,
+        "router": route,
+        "router_json": route_json,
+        "router_metrics": route_with_metrics,
+    }
+    for backend, batch_decoder in batch_decoders.items():
+        decoders[f"batch_decoder_{backend}"] = make_batch_decoder(batch_decoder)
+    decoders["router_batch"] = route_batch
+    if not protobuf_ref_ids:
+        # the legacy decoder can't decode protobuf payloads
+        decoders["legacy_decode_message"] = legacy_decode_message
+    return decoders
+
+
+def measure(decoder: Decoder, messages: List[bytes], repeat: int) -> Dict[str, float]:
+    total_bytes = sum(len(message) for message in messages)
+    best = float("inf")
+    frames = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = 0
+        for message in messages:
+            frames += decoder(message)
+        best = min(best, time.perf_counter() - start)
+
+    # allocations are measured separately, as tracing slows down the decoder a lot
+    tracemalloc.start()
+    for message in messages:
+        decoder(message)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "frames_per_second": frames / best,
+        "bytes_per_second": total_bytes / best,
+        "peak_allocated_bytes": peak,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--max-frames", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--protobuf", action="store_true", help="include protobuf payloads"
+    )
+    parser.add_argument(
+        "--capture", help="use the messages of this capture file (see capture.py)"
+    )
+    parser.add_argument("--save", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+    if args.capture and args.protobuf:
+        # the protobuf payloads of a capture can't be decoded without their schemas
+        parser.error("--protobuf can't be combined with --capture")
+
+    protobuf_ref_ids = []
+    if args.protobuf:
+        if protobuf_message_class() is None:
+            parser.error("the protobuf package is required for --protobuf")
+        protobuf_ref_ids = ["protobuf-prices-1", "pb2"]
+
+    if args.capture:
+        with CaptureReader(args.capture) as capture:
+            messages = [bytes(message) for _, message in capture]
+        ref_ids = sorted(
+            {
+                frame.ref_id
+                for message in messages
+                for frame in iter_frames(message)
+                if not frame.ref_id.startswith("_")
+            }
+            - set(protobuf_ref_ids)
+        )
+    else:
+        ref_ids = generate_ref_ids(random.Random(42), 10)
+        messages = generate_messages(
+            args.messages, args.max_frames, ref_ids, protobuf_ref_ids
+        )
+    print(
+        f"{len(messages)} messages, {sum(parse_only(m) for m in messages)} frames, "
+        f"{sum(len(m) for m in messages)} bytes"
+    )
+
+    results = {}
+    for name, decoder in build_decoders(ref_ids, protobuf_ref_ids).items():
+        results[name] = measure(decoder, messages, args.repeat)
+        print(
+            f"{name:>24}: {results[name]['frames_per_second']:>12,.0f} frames/s "
+            f"{results[name]['bytes_per_second'] / 1e6:>8.1f} MB/s "
+            f"{results[name]['peak_allocated_bytes'] / 1e3:>8.1f} kB peak allocated"
+        )
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = [
+            name
+            for name, result in results.items()
+            if name in baseline
+            and result["frames_per_second"]
+            < baseline[name]["frames_per_second"] * (1 - args.tolerance)
+        ]
+        if regressions:
+            print(f"performance regression in: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# tested in Python 3.6+
+# required packages: none (standard library only)
+
+"""Recording of raw websocket messages to a file, and replay through the decoders.
+
+A capture file starts with the 8 byte magic `SAXOWSC1`, followed by one record per
+websocket message:
+
+    | receive time (8, double, epoch seconds) | Smessage (4) | message (Smessage) |
+
+All numbers are little endian. The recorder only appends, so a capture can be copied
+while it is being written; a record that was cut off (e.g. by a crash) at the end of the
+file is ignored when reading, and removed when a recorder appends to the capture again.
+
+The reader maps the file into memory, so messages are handed out as views of the file
+without reading or copying them. Replay passes the messages to a handler (for example
+`ReconnectingStreamer.handle_message`) as fast as possible, or paced like they were
+received:
+
+    with CaptureReader("capture.bin") as capture:
+        replay(capture, streamer.handle_message, speed=1.0)
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Any, BinaryIO, Callable, Iterator, NamedTuple, Optional, Union
+
+from pipeline import Pipeline
+
+MAGIC = b"SAXOWSC1"
+
+# receive time (seconds since the epoch) and size of the message
+RECORD_HEADER = struct.Struct("<dI")
+
+
+class CaptureError(ValueError):
+    pass
+
+
+class Record(NamedTuple):
+    timestamp: float
+    message: memoryview
+
+
+class FrameRecorder:
+    """Appends raw websocket messages with their receive time to a capture file.
+
+    Writes are buffered (`buffer_size` bytes), call `flush()` to write them to the file
+    immediately. An incomplete record at the end of an existing capture is removed
+    before new records are appended.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 20):
+        self.path = path
+        self.records = 0
+        if os.path.exists(path) and os.path.getsize(path):
+            _check_magic(path)
+            _truncate_incomplete(path)
+        self._file: BinaryIO = open(path, "ab", buffering=buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def __enter__(self) -> "FrameRecorder":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def record(
+        self, message: Union[bytes, str], timestamp: Optional[float] = None
+    ) -> None:
+        """Append a message, received at `timestamp` (now by default)."""
+
+        if isinstance(message, str):
+            message = message.encode()
+        self._file.write(
+            RECORD_HEADER.pack(
+                time.time() if timestamp is None else timestamp, len(message)
+            )
+        )
+        self._file.write(message)
+        self.records += 1
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class CaptureReader:
+    """Reads the records of a capture file from a memory map.
+
+    The messages are views of the mapped file, which are only valid until the reader is
+    closed. Copy a message with `bytes(message)` to keep it longer.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        _check_magic(path)
+        with open(path, "rb") as capture_file:
+            self._mmap = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def __enter__(self) -> "CaptureReader":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Record]:
+        view = self._view
+        end = len(view)
+        index = len(MAGIC)
+        unpack_header = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        while index + header_size <= end:
+            timestamp, size = unpack_header(view, index)
+            index += header_size
+            if index + size > end:
+                logging.warning(f"ignoring incomplete record at the end of {self.path}")
+                return
+            yield Record(timestamp, view[index : index + size])
+            index += size
+
+    def close(self) -> None:
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # messages are still referenced, the map is closed when they are collected
+            logging.debug(f"messages of {self.path} still in use, not closing the map")
+
+
+def replay(
+    capture: CaptureReader,
+    handle_message: Callable[[memoryview], Any],
+    speed: Optional[float] = None,
+) -> int:
+    """Pass every message of the capture to `handle_message`, return the message count.
+
+    Without `speed` messages are replayed as fast as possible, otherwise the recorded
+    time between messages is divided by `speed` (1.0 replays at the recorded speed).
+    """
+
+    messages = 0
+    start = first = None
+    for timestamp, message in capture:
+        if speed:
+            if first is None:
+                start, first = time.perf_counter(), timestamp
+            else:
+                delay = start + (timestamp - first) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        handle_message(message)
+        messages += 1
+    return messages
+
+
+async def replay_async(
+    capture: CaptureReader,
+    handle_message: Callable[[memoryview], Any],
+    speed: Optional[float] = None,
+    pipeline: Optional[Pipeline] = None,
+) -> int:
+    """Like `replay()`, but waits on the event loop, so its consumers keep running.
+
+    With a `pipeline` (see pipeline.py), replay waits while the queue of the pipeline is
+    full, like the ReconnectingStreamer does.
+    """
+
+    messages = 0
+    start = first = None
+    for timestamp, message in capture:
+        if speed:
+            if first is None:
+                start, first = time.perf_counter(), timestamp
+            else:
+                delay = start + (timestamp - first) / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        handle_message(message)
+        messages += 1
+        if pipeline is not None:
+            await pipeline.wait_for_capacity()
+        elif not speed:
+            await asyncio.sleep(0)
+    return messages
+
+
+def _check_magic(path: str) -> None:
+    with open(path, "rb") as capture_file:
+        if capture_file.read(len(MAGIC)) != MAGIC:
+            raise CaptureError(f"{path} is not a capture file")
+
+
+def _truncate_incomplete(path: str) -> None:
+    """Cut a record that was not completely written off the end of the capture."""
+
+    with open(path, "r+b") as capture_file:
+        end = capture_file.seek(0, os.SEEK_END)
+        index = len(MAGIC)
+        while index + RECORD_HEADER.size <= end:
+            capture_file.seek(index)
+            _, size = RECORD_HEADER.unpack(capture_file.read(RECORD_HEADER.size))
+            if index + RECORD_HEADER.size + size > end:
+                break
+            index += RECORD_HEADER.size + size
+        if index < end:
+            logging.warning(
+                f"removing incomplete record at the end of {path} ({end - index} bytes)"
+            )
+            capture_file.truncate(index)
@@ -0,0 +1,244 @@
+# tested in Python 3.6+
+# required packages: none (standard library only)
+
+"""Conflation of price deltas: only the latest state of every instrument is passed on.
+
+During a burst the server may send many deltas for the same instrument before a consumer
+can process them. Deltas of the same subscription (ref_id) and Uic that are still
+pending are merged into one, so the consumer does the work once per instrument instead
+of once per delta:
+
+- ConflationBuffer: pending messages in arrival order, merged per ref_id and Uic
+- ConflatingSink: collects messages and passes them on to another sink once per
+  `interval` seconds, so the sink receives at most one update per instrument per
+  interval
+
+Merged deltas are equal to applying all of them in order (see `price_store.merge`), so a
+sink that keeps state (like InfoPriceStore) ends up in the same state with and without
+conflation.
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+from metrics import CONFLATION_EMITTED_TOTAL, CONFLATION_MERGED_TOTAL, Metrics
+from price_store import merge
+from sinks import Sink, StreamMessage
+
+
+def _copy(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: _copy(value) if isinstance(value, dict) else value
+        for key, value in item.items()
+    }
+
+
+class ConflationBuffer:
+    """Pending messages in arrival order, with the deltas of a ref_id and Uic merged.
+
+    Every delta of a message (an item with a `Uic` in a list) is kept as a separate
+    message, so the output contains at most one message per instrument. Other messages
+    are queued as they are.
+    """
+
+    def __init__(self) -> None:
+        self._pending: "OrderedDict[Hashable, StreamMessage]" = OrderedDict()
+        # keys of merged deltas, which are copies that can be updated in place
+        self._owned: Set[Hashable] = set()
+        # number of the latest pushed message in every pending message, message ids are
+        # opaque and can't tell which message is the latest
+        self._arrivals: Dict[Hashable, int] = {}
+        # keys of pending messages without a Uic, oldest first
+        self._without_uic: Deque[int] = deque()
+        self._received = 0
+        self._sequence = 0
+        self.conflated = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def push(self, message: StreamMessage) -> None:
+        self._received += 1
+        if not isinstance(message.data, list):
+            self._push_unique(message)
+            self._without_uic.append(self._sequence)
+            return
+        for item in message.data:
+            uic = item.get("Uic") if isinstance(item, dict) else None
+            if uic is None:
+                self._push_unique(StreamMessage(message.msg_id, message.ref_id, [item]))
+                self._without_uic.append(self._sequence)
+                continue
+            key = (message.ref_id, uic)
+            self._arrivals[key] = self._received
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = StreamMessage(
+                    message.msg_id, message.ref_id, [item]
+                )
+            elif pending.data[0].get("__meta_deleted"):
+                # an update after a delete starts a new record, so the delete must be
+                # passed on first
+                self._owned.discard(key)
+                self._push_unique(self._pending.pop(key), self._arrivals[key])
+                self._arrivals[key] = self._received
+                self._pending[key] = StreamMessage(
+                    message.msg_id, message.ref_id, [item]
+                )
+            elif item.get("__meta_deleted"):
+                # a delete makes all pending updates of the instrument irrelevant
+                self._owned.discard(key)
+                self._pending[key] = pending._replace(
+                    msg_id=message.msg_id, data=[item]
+                )
+                self.conflated += 1
+            else:
+                # the first delta may still be referenced by other sinks, so it is
+                # copied before merging
+                delta = pending.data[0]
+                if key not in self._owned:
+                    delta = _copy(delta)
+                    self._owned.add(key)
+                merge(delta, item)
+                # keep the position in the queue, but report the latest message id
+                self._pending[key] = pending._replace(
+                    msg_id=message.msg_id, data=[delta]
+                )
+                self.conflated += 1
+
+    def pop(self) -> StreamMessage:
+        """Remove and return the oldest pending message."""
+
+        key, message = self._pending.popitem(last=False)
+        self._owned.discard(key)
+        del self._arrivals[key]
+        if self._without_uic and self._without_uic[0] == key:
+            self._without_uic.popleft()
+        return message
+
+    def pop_overflow(self) -> StreamMessage:
+        """Remove and return the oldest message without a Uic.
+
+        Only when every pending message has a Uic, the oldest one is removed, so the
+        deltas of an instrument are only lost with more instruments than fit in the
+        buffer.
+        """
+
+        if not self._without_uic:
+            return self.pop()
+        key = self._without_uic.popleft()
+        del self._arrivals[key]
+        return self._pending.pop(key)
+
+    def drain(self) -> List[StreamMessage]:
+        return [message for _, message in self.drain_with_arrivals()]
+
+    def drain_with_arrivals(self) -> List[Tuple[int, StreamMessage]]:
+        """Remove all pending messages, each with its arrival (higher is later)."""
+
+        messages = [(self._arrivals[key], m) for key, m in self._pending.items()]
+        self._pending.clear()
+        self._owned.clear()
+        self._arrivals.clear()
+        self._without_uic.clear()
+        return messages
+
+    def _push_unique(
+        self, message: StreamMessage, arrival: Optional[int] = None
+    ) -> None:
+        self._sequence += 1
+        self._pending[self._sequence] = message
+        self._arrivals[self._sequence] = self._received if arrival is None else arrival
+
+
+class ConflatingSink(Sink):
+    """Passes messages on to `sink` every `interval` seconds, with deltas merged.
+
+    The pending deltas of consecutive messages of the same subscription are sent as one
+    message (with the id of the latest message), unless `batch` is False. Messages are
+    delayed by at most `interval` seconds; `flush()` passes them on immediately.
+
+    The timer runs on the event loop, so `send()` must be called from the event loop
+    thread (as the MessageRouter does).
+    """
+
+    def __init__(
+        self,
+        sink: Sink,
+        interval: float = 0.1,
+        batch: bool = True,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.sink = sink
+        self.interval = interval
+        self.batch = batch
+        self.metrics = metrics
+        self._buffer = ConflationBuffer()
+        self._loop = asyncio.get_event_loop()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def conflated(self) -> int:
+        return self._buffer.conflated
+
+    def send(self, message: StreamMessage) -> None:
+        conflated = self._buffer.conflated
+        self._buffer.push(message)
+        if self.metrics is not None and self._buffer.conflated != conflated:
+            self.metrics.inc(
+                CONFLATION_MERGED_TOTAL, self._buffer.conflated - conflated
+            )
+        if self._timer is None:
+            self._timer = self._loop.call_later(self.interval, self.flush)
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending = self._buffer.drain_with_arrivals()
+        if self.metrics is not None and pending:
+            self.metrics.inc(CONFLATION_EMITTED_TOTAL, len(pending))
+        if self.batch:
+            messages = _batches(pending)
+        else:
+            messages = [message for _, message in pending]
+        for message in messages:
+            self.sink.send(message)
+
+    def close(self) -> None:
+        self.flush()
+        self.sink.close()
+
+
+def _batches(pending: List[Tuple[int, StreamMessage]]) -> List[StreamMessage]:
+    """Combine consecutive list messages of the same ref_id into one message.
+
+    A batch has the id of the message that arrived last, of all messages in it.
+    """
+
+    batches: List[StreamMessage] = []
+    latest = 0
+    for arrival, message in pending:
+        last = batches[-1] if batches else None
+        if (
+            last is not None
+            and last.ref_id == message.ref_id
+            and isinstance(last.data, list)
+            and isinstance(message.data, list)
+        ):
+            last.data.extend(message.data)
+            if arrival > latest:
+                latest = arrival
+                batches[-1] = last._replace(msg_id=message.msg_id)
+        else:
+            latest = arrival
+            batches.append(
+                message._replace(data=list(message.data))
+                if isinstance(message.data, list)
+                else message
+            )
+    return batches
@@ -0,0 +1,127 @@
+# tested in Python 3.6+
+# required packages: none (standard library only)
+
+"""Zero-copy parser for Saxo OpenAPI plain websocket message frames.
+
+A single websocket message can contain multiple frames. Every frame is laid out as
+follows, see here for more details:
+https://www.developer.saxo/openapi/learn/plain-websocket-streaming
+
+    | msg_id (8) | version (2) | Srefid (1) | ref_id (Srefid) |
+    | format (1) | Spayload (4) | payload (Spayload) |
+
+The parser walks the frames using a memoryview over the received message, so the payload
+is never copied. Fixed-size header fields are unpacked with precompiled structs.
+
+`slice_frames()` is the original parser of the samples, which slices every field out of
+the message. It is kept as the reference for benchmark_decoder.py.
+"""
+
+import struct
+from typing import Iterator, List, NamedTuple, Tuple, Union
+
+# Message identifier (8 bytes), version number (2 bytes) and reference id size 'Srefid'
+# (1 byte)
+# The message identifier is used by clients when reconnecting. It may not be a sequence
+# number and no interpretation of its meaning should be attempted at the client.
+FRAME_HEADER = struct.Struct("<QHB")
+
+# Payload format (1 byte) and payload size 'Spayload' (4 bytes)
+# Currently the following formats are defined:
+#  0: The payload is a UTF-8 encoded text string containing JSON.
+#  1: The payload is a binary protobuffer message.
+# The format is selected when the client sets up a streaming subscription so the
+# streaming connection may deliver a mixture of message formats. Control messages such
+# as subscription resets are not bound to a specific subscription and are always sent in
+# JSON format.
+PAYLOAD_HEADER = struct.Struct("<BI")
+
+PAYLOAD_FORMAT_JSON = 0
+PAYLOAD_FORMAT_PROTOBUF = 1
+
+
+class Frame(NamedTuple):
+    """A single frame from a websocket message.
+
+    The payload is a view into the original message.
+    """
+
+    msg_id: int
+    ref_id: str
+    payload_format: int
+    payload: memoryview
+
+
+class FrameParseError(ValueError):
+    pass
+
+
+def iter_frames(message: Union[bytes, bytearray, memoryview]) -> Iterator[Frame]:
+    """Yield every frame of a (binary) websocket message, without copying payloads."""
+
+    view = memoryview(message)
+    end = len(view)
+    index = 0
+    unpack_frame_header = FRAME_HEADER.unpack_from
+    unpack_payload_header = PAYLOAD_HEADER.unpack_from
+    frame_header_size = FRAME_HEADER.size
+    payload_header_size = PAYLOAD_HEADER.size
+    # skips the Python-level __new__ of the named tuple
+    new_frame = tuple.__new__
+
+    try:
+        while index < end:
+            # a truncated header makes unpack_from raise struct.error
+            msg_id, _version, ref_id_length = unpack_frame_header(view, index)
+            index += frame_header_size
+
+            # reference ids are short ASCII strings, the default (UTF-8) decoder of
+            # bytes is the fastest way to turn them into a str
+            ref_id = view[index : index + ref_id_length].tobytes().decode()
+            index += ref_id_length
+
+            payload_format, payload_size = unpack_payload_header(view, index)
+            index += payload_header_size
+
+            if index + payload_size > end:
+                raise FrameParseError(
+                    f"payload of {payload_size} bytes for '{ref_id}' "
+                    "exceeds message length"
+                )
+            yield new_frame(
+                Frame,
+                (msg_id, ref_id, payload_format, view[index : index + payload_size]),
+            )
+            index += payload_size
+    except struct.error:
+        raise FrameParseError(f"truncated frame header at offset {index}")
+
+
+def parse_frames(message: Union[bytes, bytearray, memoryview]) -> List[Frame]:
+    """Parse all frames of a websocket message into a list."""
+
+    return list(iter_frames(message))
+
+
+def slice_frames(message: bytes) -> Iterator[Tuple[int, str, int, bytes]]:
+    """Yield (msg_id, ref_id, payload_format, payload) of every frame, as copies.
+
+    This is the original parser of the samples, without validation of the frame lengths.
+    """
+
+    index = 0
+    while index < len(message):
+        msg_id = int.from_bytes(message[index : index + 8], byteorder="little")
+        # the version number (2 bytes) is ignored
+        index += 10
+        ref_id_length = message[index]
+        index += 1
+        ref_id = message[index : index + ref_id_length].decode()
+        index += ref_id_length
+        payload_format = message[index]
+        index += 1
+        payload_size = int.from_bytes(message[index : index + 4], byteorder="little")
+        index += 4
+        payload = message[index : index + payload_size]
+        index += payload_size
+        yield msg_id, ref_id, payload_format, payload
@@ -0,0 +1,290 @@
+# tested in Python 3.6+
+# required packages: none (standard library only)
+
+"""Counters, gauges and histograms of a streaming connection, and a Prometheus exporter.
+
+Components that are instrumented (MessageRouter, ReconnectingStreamer, the samples)
+accept any object that implements the `Metrics` interface, and skip all measurements
+when no metrics are configured. The `InMemoryMetrics` implementation keeps the values in
+memory and renders them for `PrometheusExporter`, which serves them on
+http://localhost:8000/metrics (by default) for a Prometheus scraper.
+
+The following metrics are recorded:
+
+- saxo_streaming_messages_total, saxo_streaming_message_bytes_total: received websocket
+  messages
+- saxo_streaming_frames_total, saxo_streaming_frame_bytes_total: frames and payload
+  bytes per ref_id
+- saxo_streaming_decode_errors_total: payloads that could not be decoded, per ref_id
+- saxo_streaming_message_errors_total: messages that could not be parsed, or whose
+  handler raised an exception
+- saxo_streaming_decode_seconds: time to decode a payload
+- saxo_streaming_message_decode_seconds: time to decode all payloads of a message at
+  once (BatchDecoder)
+- saxo_streaming_server_lag_seconds: time between the latest `LastUpdated` in a frame
+  and its local receive time
+- saxo_streaming_heartbeat_interval_seconds: time between two heartbeats
+- saxo_streaming_reconnects_total, saxo_streaming_connected: reconnects, and whether a
+  connection is open
+- saxo_pipeline_queue_depth, saxo_pipeline_dropped_total, saxo_pipeline_conflated_total:
+  state of the queue of a Pipeline (see pipeline.py)
+- saxo_pipeline_handler_seconds: time spent in the handler of a Pipeline per message
+- saxo_conflation_merged_total, saxo_conflation_emitted_total: deltas merged into a
+  pending delta, and updates passed on by a ConflatingSink (see conflation.py)
+- saxo_shard_running, saxo_shard_instruments, saxo_shard_restarts_total: state of every
+  worker process of a ShardedStreamer (see sharded.py)
+"""
+
+import calendar
+import logging
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+MESSAGES_TOTAL = "saxo_streaming_messages_total"
+MESSAGE_BYTES_TOTAL = "saxo_streaming_message_bytes_total"
+FRAMES_TOTAL = "saxo_streaming_frames_total"
+FRAME_BYTES_TOTAL = "saxo_streaming_frame_bytes_total"
+DECODE_ERRORS_TOTAL = "saxo_streaming_decode_errors_total"
+MESSAGE_ERRORS_TOTAL = "saxo_streaming_message_errors_total"
+DECODE_SECONDS = "saxo_streaming_decode_seconds"
+MESSAGE_DECODE_SECONDS = "saxo_streaming_message_decode_seconds"
+SERVER_LAG_SECONDS = "saxo_streaming_server_lag_seconds"
+HEARTBEAT_INTERVAL_SECONDS = "saxo_streaming_heartbeat_interval_seconds"
+RECONNECTS_TOTAL = "saxo_streaming_reconnects_total"
+CONNECTED = "saxo_streaming_connected"
+PIPELINE_QUEUE_DEPTH = "saxo_pipeline_queue_depth"
+PIPELINE_DROPPED_TOTAL = "saxo_pipeline_dropped_total"
+PIPELINE_CONFLATED_TOTAL = "saxo_pipeline_conflated_total"
+PIPELINE_HANDLER_SECONDS = "saxo_pipeline_handler_seconds"
+CONFLATION_MERGED_TOTAL = "saxo_conflation_merged_total"
+CONFLATION_EMITTED_TOTAL = "saxo_conflation_emitted_total"
+SHARD_RUNNING = "saxo_shard_running"
+SHARD_INSTRUMENTS = "saxo_shard_instruments"
+SHARD_RESTARTS_TOTAL = "saxo_shard_restarts_total"
+
+# upper bounds (in seconds) of the histogram buckets, from 10 microseconds to a minute
+DEFAULT_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """Interface of a metrics backend, labels are passed as keyword arguments.
+
+    This base class ignores all values, subclass it to send metrics to another system
+    (e.g. statsd).
+    """
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increase counter `name` by `value`."""
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Set gauge `name` to `value`."""
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Add `value` to histogram `name`."""
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        # the last count is for values above the largest bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class InMemoryMetrics(Metrics):
+    """Keeps all metrics in memory, `render()` returns them in the Prometheus format."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = _key(labels)
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = _key(labels)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels: str) -> float:
+        return self._counters.get(name, {}).get(_key(labels), 0)
+
+    def gauge(self, name: str, **labels: str) -> Optional[float]:
+        return self._gauges.get(name, {}).get(_key(labels))
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self._histograms.get(name, {}).get(_key(labels))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, values in sorted(metrics.items()):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for labels, value in sorted(values.items()):
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(
+                        list(histogram.buckets) + ["+Inf"], histogram.counts
+                    ):
+                        cumulative += count
+                        bucket_labels = _format_labels(labels + (("le", str(bound)),))
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def _key(labels: Dict[str, str]) -> Labels:
+    # sorting is only needed to make the key independent of the order of multiple labels
+    if len(labels) < 2:
+        return tuple(labels.items())
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def parse_timestamp(value: str) -> float:
+    """Parse a UTC timestamp like `2022-01-17T12:11:29.62Z` to seconds since epoch."""
+
+    seconds, _, fraction = value.rstrip("Z").partition(".")
+    timestamp = _parse_seconds(seconds)
+    return timestamp + float("0." + fraction) if fraction else float(timestamp)
+
+
+# consecutive timestamps of a stream mostly fall in the same second, so the date and
+# time part is cached
+@lru_cache(maxsize=1024)
+def _parse_seconds(seconds: str) -> int:
+    return calendar.timegm(
+        (
+            int(seconds[0:4]),
+            int(seconds[5:7]),
+            int(seconds[8:10]),
+            int(seconds[11:13]),
+            int(seconds[14:16]),
+            int(seconds[17:19]),
+        )
+    )
+
+
+def observe_server_lag(metrics: Metrics, data: Any) -> None:
+    """Record the time since the latest `LastUpdated` in a decoded (JSON) delta list."""
+
+    if not isinstance(data, list):
+        return
+    # timestamps have the same format, so the most recent one is also the largest string
+    last_updated = max(
+        (item.get("LastUpdated") or "" for item in data if isinstance(item, dict)),
+        default="",
+    )
+    if last_updated:
+        try:
+            metrics.observe(
+                SERVER_LAG_SECONDS, time.time() - parse_timestamp(last_updated)
+            )
+        except ValueError:
+            pass
+
+
+class PrometheusExporter:
+    """Serves the metrics on http://host:port/metrics from a background thread."""
+
+    def __init__(
+        self, metrics: InMemoryMetrics, host: str = "localhost", port: int = 8000
+    ):
+        self.metrics = metrics
+        self.server = HTTPServer((host, port), _make_request_handler(metrics))
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics-exporter", daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self) -> None:
+        self._thread.start()
+        logging.debug(f"serving metrics on {self.url}")
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _make_request_handler(metrics: InMemoryMetrics) -> Any:
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return MetricsRequestHandler
@@ -0,0 +1,197 @@
+# tested in Python 3.6+
+# required packages: protobuf and grpcio-tools, for protobuf payloads only (orjson is
+# used when it is installed)
+
+"""Decoding of frame payloads into Python objects.
+
+JSON payloads (payload_format 0) are decoded with orjson when it is installed, otherwise
+with the json module. Protobuf payloads (payload_format 1) are decoded with the message
+class registered for the reference id of the frame. When a subscription is created with
+`"Format": "application/x-protobuf"`, the response contains the protobuf schema
+(`Schema`) and the name of the message type (`SchemaName`) which can be registered with
+`register_schema()`. See here for more details:
+https://www.developer.saxo/openapi/learn/plain-websocket-streaming
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Callable, Dict, Optional, Type, Union
+
+from frame_parser import PAYLOAD_FORMAT_JSON, PAYLOAD_FORMAT_PROTOBUF, Frame
+
+try:
+    from google.protobuf.message import DecodeError as ProtobufDecodeError
+except ImportError:
+    # without protobuf no message class can be registered, so nothing raises it
+    ProtobufDecodeError = ValueError  # type: ignore[misc,assignment]
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FORMAT_JSON = "application/json"
+FORMAT_PROTOBUF = "application/x-protobuf"
+
+Payload = Union[bytes, bytearray, memoryview]
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+class PayloadDecodeError(ValueError):
+    pass
+
+
+class PayloadDecoder:
+    """Decodes frame payloads, with a protobuf message class per reference id.
+
+    `backend` is "orjson" or "json", by default orjson is used when it is installed.
+    """
+
+    def __init__(self, backend: Optional[str] = None) -> None:
+        if backend is None:
+            backend = "orjson" if orjson is not None else "json"
+        if backend == "orjson" and orjson is None:
+            raise ImportError("the orjson package is not installed")
+        if backend not in ("orjson", "json"):
+            raise ValueError(f"unknown JSON backend {backend!r}")
+        self.backend = backend
+        self._decode_json: Callable[[Payload], Any] = (
+            orjson.loads if backend == "orjson" else _decode_json_text
+        )
+        self._message_classes: Dict[str, Type[Any]] = {}
+
+    def register_protobuf(self, ref_id: str, message_class: Type[Any]) -> None:
+        """Decode protobuf payloads of `ref_id` with `message_class` (from protoc)."""
+
+        self._message_classes[ref_id] = message_class
+
+    def register_schema(self, ref_id: str, schema: str, schema_name: str) -> None:
+        """Compile the schema of a subscription and register its message type."""
+
+        self.register_protobuf(ref_id, compile_schema(schema, schema_name))
+
+    def unregister(self, ref_id: str) -> None:
+        self._message_classes.pop(ref_id, None)
+
+    def decode(self, frame: Frame) -> Any:
+        """Decode the payload of a frame, raises PayloadDecodeError if it is invalid."""
+
+        return self.decode_payload(frame.ref_id, frame.payload_format, frame.payload)
+
+    def decode_payload(self, ref_id: str, payload_format: int, payload: Payload) -> Any:
+        """Decode a payload of `ref_id`, without a Frame (see MessageRouter)."""
+
+        if payload_format == PAYLOAD_FORMAT_JSON:
+            try:
+                return self._decode_json(payload)
+            except ValueError as error:
+                # (or)json.JSONDecodeError, or UnicodeDecodeError for invalid UTF-8
+                raise PayloadDecodeError(f"invalid JSON payload: {error}") from error
+
+        if payload_format == PAYLOAD_FORMAT_PROTOBUF:
+            message_class = self._message_classes.get(ref_id)
+            if message_class is None:
+                raise PayloadDecodeError(
+                    f"no protobuf schema registered for subscription {ref_id}"
+                )
+            message = message_class()
+            try:
+                # protobuf accepts any buffer, so a payload view is parsed as it is
+                message.ParseFromString(payload)
+            except ProtobufDecodeError as error:
+                raise PayloadDecodeError(
+                    f"invalid protobuf payload: {error}"
+                ) from error
+            return message
+
+        raise PayloadDecodeError(
+            f"an unsupported payload_format is sent by the server: {payload_format}"
+        )
+
+
+def _decode_json_text(payload: Payload) -> Any:
+    # decoding bytes is faster than str(payload, "utf-8"), which is only needed for
+    # views (from decode())
+    if isinstance(payload, bytes):
+        return _JSON_DECODER.decode(payload.decode())
+    return _JSON_DECODER.decode(str(payload, "utf-8"))
+
+
+# compiled schemas are shared between subscriptions, as every subscription of the same
+# type has the same schema
+_compiled_schemas: Dict[str, Type[Any]] = {}
+
+
+def compile_schema(schema: str, schema_name: str) -> Type[Any]:
+    """Compile a .proto schema with grpcio-tools, return message class `schema_name`.
+
+    protoc only writes a descriptor set (in a private temporary directory), and the
+    message class is built from it in memory, so no generated code is imported.
+    """
+
+    digest = hashlib.sha256(schema.encode()).hexdigest()[:16]
+    key = f"{digest}.{schema_name}"
+    if key in _compiled_schemas:
+        return _compiled_schemas[key]
+
+    try:
+        from google.protobuf import descriptor_pb2, descriptor_pool
+        from grpc_tools import protoc
+    except ImportError as error:
+        raise PayloadDecodeError(
+            "grpcio-tools is required to compile protobuf schemas, "
+            "alternatively register a generated message class with register_protobuf()"
+        ) from error
+
+    include_dir = os.path.join(os.path.dirname(protoc.__file__), "_proto")
+    with tempfile.TemporaryDirectory(prefix="saxo_schema_") as output_dir:
+        with open(os.path.join(output_dir, "schema.proto"), "w") as proto_file:
+            proto_file.write(schema)
+        descriptor_path = os.path.join(output_dir, "schema.desc")
+        result = protoc.main(
+            [
+                "protoc",
+                f"-I{output_dir}",
+                f"-I{include_dir}",
+                "--include_imports",
+                f"--descriptor_set_out={descriptor_path}",
+                "schema.proto",
+            ]
+        )
+        if result != 0:
+            raise PayloadDecodeError(
+                f"failed to compile protobuf schema '{schema_name}'"
+            )
+        with open(descriptor_path, "rb") as descriptor_file:
+            descriptor_set = descriptor_pb2.FileDescriptorSet.FromString(
+                descriptor_file.read()
+            )
+
+    # imported files come first in the descriptor set, before the files that use them
+    pool = descriptor_pool.DescriptorPool()
+    for file_proto in descriptor_set.file:
+        pool.Add(file_proto)
+    package = descriptor_set.file[-1].package
+    full_name = f"{package}.{schema_name}" if package else schema_name
+    try:
+        descriptor = pool.FindMessageTypeByName(full_name)
+    except KeyError as error:
+        raise PayloadDecodeError(
+            f"protobuf schema does not define message '{schema_name}'"
+        ) from error
+
+    _compiled_schemas[key] = _message_class(pool, descriptor)
+    return _compiled_schemas[key]
+
+
+def _message_class(pool: Any, descriptor: Any) -> Type[Any]:
+    from google.protobuf import message_factory
+
+    if hasattr(message_factory, "GetMessageClass"):
+        return message_factory.GetMessageClass(descriptor)
+    return message_factory.MessageFactory(pool).GetPrototype(
+        descriptor
+    )  # protobuf < 4.21
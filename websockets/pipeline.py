@@ -0,0 +1,183 @@
+# tested in Python 3.6+
+# required packages: none (standard library only)
+
+"""Bounded queue between the websocket reader and the (slow) handlers of messages.
+
+The reader only decodes frames and puts the messages in the queue, consumer tasks take
+them out and call the handler - on the event loop, or in a thread or process pool. What
+happens when the handler can't keep up and the queue is full is decided by the overflow
+policy:
+
+- BLOCK: the reader stops reading from the websocket until there is room again (nothing
+  is lost, but the server may drop a connection that is not read for too long)
+- DROP_OLDEST: the oldest queued message is discarded
+- CONFLATE: queued deltas of the same subscription and Uic are merged into one, so the
+  handler receives the latest quote of every instrument, see conflation.py. When the
+  queue is still full, messages without a Uic are discarded oldest first; only when
+  all queued messages have a Uic (more instruments than `maxsize`), the merged delta of
+  the oldest instrument is discarded, and its updates are lost
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import Executor
+from enum import Enum
+from typing import Any, Callable, Deque, List, Optional
+
+from conflation import ConflationBuffer
+from metrics import (
+    PIPELINE_CONFLATED_TOTAL,
+    PIPELINE_DROPPED_TOTAL,
+    PIPELINE_HANDLER_SECONDS,
+    PIPELINE_QUEUE_DEPTH,
+    Metrics,
+)
+from sinks import Sink, StreamMessage
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    CONFLATE = "conflate"
+
+
+class Pipeline(Sink):
+    """Queues decoded messages and hands them to `handler` from `workers` consumers.
+
+    Register `pipeline.send` as handler of the subscriptions, and pass the pipeline to
+    the ReconnectingStreamer so it can stop reading while the queue is full (BLOCK
+    policy).
+
+    With an `executor` (a ThreadPoolExecutor or ProcessPoolExecutor) the handler runs in
+    the executor, so a slow or CPU bound handler never blocks the event loop. The
+    handler of a process pool must be a module-level function. With more than one
+    worker, messages may be handled out of order.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[StreamMessage], Any],
+        maxsize: int = 10000,
+        policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        executor: Optional[Executor] = None,
+        workers: int = 1,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.executor = executor
+        self.metrics = metrics
+        self.dropped = 0
+        self._queue: Deque[StreamMessage] = deque()
+        self._conflation = ConflationBuffer()
+        self._buffer: Any = (
+            self._conflation if policy is OverflowPolicy.CONFLATE else self._queue
+        )
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._workers = workers
+        self._tasks: List["asyncio.Future[None]"] = []
+        self._busy = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def conflated(self) -> int:
+        return self._conflation.conflated
+
+    def start(self) -> None:
+        """Start the consumer tasks, must be called from a running event loop."""
+
+        if not self._tasks:
+            self._tasks = [
+                asyncio.ensure_future(self._consume()) for _ in range(self._workers)
+            ]
+
+    def send(self, message: StreamMessage) -> None:
+        if self.policy is OverflowPolicy.CONFLATE:
+            conflated = self._conflation.conflated
+            self._conflation.push(message)
+            if self.metrics is not None and self._conflation.conflated != conflated:
+                self.metrics.inc(
+                    PIPELINE_CONFLATED_TOTAL, self._conflation.conflated - conflated
+                )
+            self._drop_overflow(self._conflation.pop_overflow)
+        else:
+            self._queue.append(message)
+            if self.policy is OverflowPolicy.DROP_OLDEST:
+                self._drop_overflow(self._queue.popleft)
+
+        if self.policy is OverflowPolicy.BLOCK and len(self._buffer) >= self.maxsize:
+            self._not_full.clear()
+        self._not_empty.set()
+        if self.metrics is not None:
+            self.metrics.set(PIPELINE_QUEUE_DEPTH, len(self._buffer))
+
+    async def wait_for_capacity(self) -> None:
+        """Wait until the queue is not full (it only fills up with the BLOCK policy)."""
+
+        await self._not_full.wait()
+
+    async def join(self) -> None:
+        """Wait until all queued messages are handled."""
+
+        while self._buffer or self._busy:
+            await asyncio.sleep(0.01)
+
+    def close(self) -> None:
+        """Stop the consumer tasks, queued messages are discarded."""
+
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def _drop_overflow(self, pop: Callable[[], StreamMessage]) -> None:
+        while len(self._buffer) > self.maxsize:
+            pop()
+            self.dropped += 1
+            if self.metrics is not None:
+                self.metrics.inc(PIPELINE_DROPPED_TOTAL)
+
+    async def _consume(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            while not self._buffer:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+            message = (
+                self._conflation.pop()
+                if self._buffer is self._conflation
+                else self._queue.popleft()
+            )
+            if len(self._buffer) < self.maxsize:
+                self._not_full.set()
+
+            self._busy += 1
+            start = time.perf_counter()
+            try:
+                if self.executor is None:
+                    result = self.handler(message)
+                    if asyncio.iscoroutine(result):
+                        await result
+                else:
+                    await loop.run_in_executor(self.executor, self.handler, message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception(f"handler failed for message {message.msg_id}")
+            finally:
+                self._busy -= 1
+
+            if self.metrics is not None:
+                self.metrics.observe(
+                    PIPELINE_HANDLER_SECONDS, time.perf_counter() - start
+                )
+                self.metrics.set(PIPELINE_QUEUE_DEPTH, len(self._buffer))
+            if self.executor is None:
+                # let the reader run between messages handled on the event loop
+                await asyncio.sleep(0)
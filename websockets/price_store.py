@@ -0,0 +1,183 @@
+# tested in Python 3.6+
+# required packages: none (standard library only)
+
+"""In-memory state of InfoPrices subscriptions, built from the snapshot and deltas.
+
+The server only sends the fields that changed since the previous message. The store
+seeds one record per Uic from the `Snapshot` in the subscription response and merges
+every delta into that record in place, so the latest quote of an instrument is available
+without re-parsing anything.
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from sinks import Sink, StreamMessage
+
+# quote fields that are stored directly on the record, all other fields are kept in
+# PriceRecord.extra
+_QUOTE_FIELDS = {
+    "Bid": "bid",
+    "Ask": "ask",
+    "Mid": "mid",
+    "Amount": "amount",
+    "MarketState": "market_state",
+}
+
+
+def merge(target: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    """Recursively apply a partial update to `target` in place."""
+
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            current = target.get(key)
+            if isinstance(current, dict):
+                merge(current, value)
+                continue
+        target[key] = value
+
+
+class PriceRecord:
+    """Latest state of a single instrument."""
+
+    __slots__ = (
+        "uic",
+        "asset_type",
+        "last_updated",
+        "bid",
+        "ask",
+        "mid",
+        "amount",
+        "market_state",
+        "extra",
+    )
+
+    def __init__(self, uic: int):
+        self.uic = uic
+        self.asset_type: Optional[str] = None
+        self.last_updated: Optional[str] = None
+        self.bid: Optional[float] = None
+        self.ask: Optional[float] = None
+        self.mid: Optional[float] = None
+        self.amount: Optional[float] = None
+        self.market_state: Optional[str] = None
+        self.extra: Dict[str, Any] = {}
+
+    def __repr__(self) -> str:
+        return (
+            f"PriceRecord(uic={self.uic}, bid={self.bid}, ask={self.ask}, "
+            f"mid={self.mid}, last_updated={self.last_updated!r})"
+        )
+
+    def update(self, data: Dict[str, Any]) -> None:
+        """Merge a snapshot item or delta for this instrument into the record."""
+
+        for key, value in data.items():
+            if key == "Quote":
+                self._update_quote(value)
+            elif key == "LastUpdated":
+                self.last_updated = value
+            elif key == "AssetType":
+                self.asset_type = value
+            elif key == "Uic":
+                continue
+            elif isinstance(value, dict) and isinstance(self.extra.get(key), dict):
+                merge(self.extra[key], value)
+            else:
+                self.extra[key] = value
+
+    def _update_quote(self, quote: Dict[str, Any]) -> None:
+        remaining = None
+        for key, value in quote.items():
+            attribute = _QUOTE_FIELDS.get(key)
+            if attribute:
+                setattr(self, attribute, value)
+            else:
+                if remaining is None:
+                    remaining = {}
+                remaining[key] = value
+        if remaining:
+            merge(self.extra.setdefault("Quote", {}), remaining)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the record in the shape of the InfoPrice data sent by the server."""
+
+        data: Dict[str, Any] = {"Uic": self.uic}
+        for key, value in self.extra.items():
+            data[key] = dict(value) if isinstance(value, dict) else value
+        if self.asset_type is not None:
+            data["AssetType"] = self.asset_type
+        if self.last_updated is not None:
+            data["LastUpdated"] = self.last_updated
+        quote = data.setdefault("Quote", {})
+        for key, attribute in _QUOTE_FIELDS.items():
+            value = getattr(self, attribute)
+            if value is not None:
+                quote[key] = value
+        return data
+
+
+class InfoPriceStore(Sink):
+    """Latest InfoPrice per Uic, seeded from a snapshot and updated with deltas.
+
+    The store can be used as a sink directly: messages for other reference ids than
+    `ref_id` are ignored.
+
+    `on_update(uic, record)` is called after every snapshot item or delta is merged,
+    with the updated record, or None when the instrument was removed.
+    """
+
+    def __init__(
+        self,
+        ref_id: Optional[str] = None,
+        on_update: Optional[Callable[[int, Optional[PriceRecord]], None]] = None,
+    ):
+        self.ref_id = ref_id
+        self.on_update = on_update
+        self._records: Dict[int, PriceRecord] = {}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, uic: int) -> bool:
+        return uic in self._records
+
+    def __iter__(self) -> Iterator[PriceRecord]:
+        return iter(self._records.values())
+
+    def get(self, uic: int) -> Optional[PriceRecord]:
+        return self._records.get(uic)
+
+    def seed(self, snapshot: Dict[str, Any]) -> None:
+        """Replace the state with the `Snapshot` object of a subscription response."""
+
+        removed = self._records
+        self._records = {}
+        self.apply(snapshot["Data"])
+        if self.on_update is not None:
+            for uic in removed.keys() - self._records.keys():
+                self.on_update(uic, None)
+
+    def apply(self, items: List[Dict[str, Any]]) -> None:
+        """Merge a list of snapshot items or deltas into the state."""
+
+        records = self._records
+        on_update = self.on_update
+        for item in items:
+            uic = item["Uic"]
+            if item.get("__meta_deleted"):
+                records.pop(uic, None)
+                if on_update is not None:
+                    on_update(uic, None)
+                continue
+            record = records.get(uic)
+            if record is None:
+                record = records[uic] = PriceRecord(uic)
+            record.update(item)
+            if on_update is not None:
+                on_update(uic, record)
+
+    def send(self, message: StreamMessage) -> None:
+        if self.ref_id is not None and message.ref_id != self.ref_id:
+            return
+        if isinstance(message.data, list):
+            self.apply(message.data)
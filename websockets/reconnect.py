@@ -0,0 +1,192 @@
+# tested in Python 3.6+
+# required packages: websockets, aiohttp
+
+"""Streaming connection that reconnects, and resumes from the last received message.
+
+Every frame carries a message id. When the connection drops, the supervisor reconnects
+with exponential backoff and passes the last message id as `messageid` parameter, so the
+server can resend the messages that were missed instead of requiring a new snapshot of
+every subscription. See here for more details:
+https://www.developer.saxo/openapi/learn/plain-websocket-streaming
+
+Frames are dispatched by a MessageRouter (see router.py). The `_disconnect` control
+message is handled here: the server asks the client to disconnect, and the connection is
+re-established from scratch.
+"""
+
+import asyncio
+import logging
+import random
+from typing import Any, Optional
+
+import aiohttp
+import websockets
+
+from async_client import OpenAPIError
+from capture import FrameRecorder
+from frame_parser import Frame
+from metrics import (
+    CONNECTED,
+    MESSAGE_BYTES_TOTAL,
+    MESSAGE_ERRORS_TOTAL,
+    MESSAGES_TOTAL,
+    RECONNECTS_TOTAL,
+)
+from pipeline import Pipeline
+from router import Callback, MessageRouter
+
+SIM_STREAMING_URL = "wss://streaming.saxobank.com/sim/openapi/streamingws/connect"
+LIVE_STREAMING_URL = "wss://streaming.saxobank.com/openapi/streamingws/connect"
+
+
+class ReconnectingStreamer:
+    """Keeps the streaming connection of a context id alive, tracks the last message id.
+
+    Every received frame is passed to `router`. After every (re)connect
+    `on_connected(resumed)` is called, `resumed` is False when the server does not hold
+    any subscriptions for this context (first connect or after `_disconnect`).
+
+    A lost connection, and a failed request of `on_connected`, make the streamer
+    reconnect with exponential backoff. Only an OpenAPIError with status 401 (invalid
+    token) is raised from `run()`. A message that can't be parsed, or whose handler
+    raises an exception, is logged and skipped.
+
+    Received messages, message errors, reconnects and the connection state are recorded
+    in the metrics of the router.
+
+    With a `pipeline` (see pipeline.py) the streamer stops reading from the websocket
+    while the queue of the pipeline is full.
+
+    With a `recorder` (see capture.py) every received message is appended to a capture
+    file before it is processed, so the stream can be replayed offline.
+    """
+
+    def __init__(
+        self,
+        context_id: str,
+        token: str,
+        router: MessageRouter,
+        on_connected: Optional[Callback] = None,
+        url: str = SIM_STREAMING_URL,
+        initial_backoff: float = 1,
+        max_backoff: float = 60,
+        pipeline: Optional[Pipeline] = None,
+        recorder: Optional[FrameRecorder] = None,
+    ):
+        self.context_id = context_id
+        self.token = token
+        self.url = url
+        self.last_message_id: Optional[int] = None
+        self.reconnects = 0
+        self.router = router
+        self._on_connected = on_connected
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._pipeline = pipeline
+        self._recorder = recorder
+        self._websocket: Any = None
+        self._stopped = False
+        self._disconnect_requested = False
+        self._close_task: Optional["asyncio.Future[None]"] = None
+        router.set_control_handler("_disconnect", self._handle_disconnect)
+
+    @property
+    def connect_url(self) -> str:
+        url = f"{self.url}?contextId={self.context_id}"
+        if self.last_message_id is not None:
+            url += f"&messageid={self.last_message_id}"
+        return url
+
+    async def run(self) -> None:
+        """Connect and process messages until `stop()` is called."""
+
+        backoff = self._initial_backoff
+        while not self._stopped:
+            resumed = self.last_message_id is not None
+            try:
+                async with websockets.connect(
+                    self.connect_url,
+                    extra_headers={"Authorization": f"Bearer {self.token}"},
+                ) as websocket:
+                    self._websocket = websocket
+                    metrics = self.router.metrics
+                    if metrics is not None:
+                        metrics.set(CONNECTED, 1)
+                    logging.debug(
+                        f"connected to context {self.context_id} (resumed={resumed})"
+                    )
+                    await self._call(self._on_connected, resumed)
+                    async for message in websocket:
+                        # only a connection that delivers messages counts as healthy
+                        backoff = self._initial_backoff
+                        if metrics is not None:
+                            metrics.inc(MESSAGES_TOTAL)
+                            metrics.inc(MESSAGE_BYTES_TOTAL, len(message))
+                        if self._recorder is not None:
+                            self._recorder.record(message)
+                        self.handle_message(message)
+                        if self._pipeline is not None:
+                            await self._pipeline.wait_for_capacity()
+            except (websockets.WebSocketException, OSError) as error:
+                logging.warning(f"streaming connection lost: {error!r}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                # a request of on_connected failed, try again after the next connect
+                logging.warning(f"request after connecting failed: {error!r}")
+            except OpenAPIError as error:
+                # an expired token can't be fixed by reconnecting
+                if error.status == 401:
+                    raise
+                logging.warning(f"request after connecting failed: {error}")
+            finally:
+                self._websocket = None
+                if self.router.metrics is not None:
+                    self.router.metrics.set(CONNECTED, 0)
+
+            if self._stopped:
+                break
+            if self._disconnect_requested:
+                # the server dropped all subscriptions of this context, reconnect now
+                self._disconnect_requested = False
+                continue
+
+            self.reconnects += 1
+            if self.router.metrics is not None:
+                self.router.metrics.inc(RECONNECTS_TOTAL)
+            delay = backoff * random.uniform(0.5, 1.0)
+            logging.debug(f"reconnecting in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, self._max_backoff)
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._websocket is not None:
+            await self._websocket.close()
+
+    def handle_message(self, message: bytes) -> None:
+        try:
+            for msg_id in self.router.route_message(message):
+                self.last_message_id = msg_id
+                if self._disconnect_requested:
+                    # message ids of the old connection can't be used to resume anymore
+                    self.last_message_id = None
+                    break
+        except Exception:
+            # a malformed message or a failing handler must not end the stream, the
+            # remaining frames of the message are skipped
+            logging.exception("could not handle streaming message")
+            if self.router.metrics is not None:
+                self.router.metrics.inc(MESSAGE_ERRORS_TOTAL)
+
+    def _handle_disconnect(self, frame: Frame) -> None:
+        logging.warning(f"server requested disconnect of context {self.context_id}")
+        self._disconnect_requested = True
+        if self._websocket is not None:
+            self._close_task = asyncio.ensure_future(self._websocket.close())
+
+    @staticmethod
+    async def _call(callback: Optional[Callback], *args: Any) -> None:
+        if callback is None:
+            return
+        result = callback(*args)
+        if asyncio.iscoroutine(result):
+            await result
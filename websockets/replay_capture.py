@@ -0,0 +1,92 @@
+# tested in Python 3.6+
+# required packages: none (standard library only)
+
+"""Replay a capture of websocket messages (see capture.py) through the decoders.
+
+Every data frame in the capture is decoded by a MessageRouter, like the samples do with
+a live connection. Replay as fast as possible and report the throughput of the decoders:
+
+    python replay_capture.py capture.bin
+
+Or replay at the recorded speed (or a multiple of it) and print the decoded messages:
+
+    python replay_capture.py capture.bin --speed 1 --print
+"""
+
+import argparse
+import sys
+import time
+from typing import Set
+
+from capture import CaptureReader, replay
+from frame_parser import iter_frames
+from metrics import InMemoryMetrics
+from payload_decoder import PayloadDecoder
+from router import MessageRouter
+from sinks import PrintSink, StreamMessage
+
+
+def data_ref_ids(capture: CaptureReader) -> Set[str]:
+    """Reference ids of all subscriptions in the capture (control messages excluded)."""
+
+    return {
+        frame.ref_id
+        for _, message in capture
+        for frame in iter_frames(message)
+        if not frame.ref_id.startswith("_")
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="capture file written by FrameRecorder")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help="multiple of the recorded speed (default: as fast as possible)",
+    )
+    parser.add_argument(
+        "--print", action="store_true", help="print the decoded messages"
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="print the metrics in the Prometheus text format",
+    )
+    args = parser.parse_args()
+
+    metrics = InMemoryMetrics() if args.metrics else None
+    router = MessageRouter(PayloadDecoder(), metrics=metrics)
+    sink = PrintSink() if args.print else None
+    frames = 0
+
+    def handle(message: StreamMessage) -> None:
+        if sink is not None:
+            sink.send(message)
+
+    def handle_message(message: memoryview) -> None:
+        nonlocal frames
+        for frame in iter_frames(message):
+            router.route(frame)
+            frames += 1
+
+    with CaptureReader(args.capture) as capture:
+        for ref_id in data_ref_ids(capture):
+            router.register(ref_id, handle)
+        start = time.perf_counter()
+        messages = replay(capture, handle_message, args.speed)
+        elapsed = time.perf_counter() - start
+
+    if sink is not None:
+        sink.close()
+    print(
+        f"replayed {messages} messages, {frames} frames in {elapsed:.3f} s: "
+        f"{messages / elapsed:,.0f} messages/s, {frames / elapsed:,.0f} frames/s"
+    )
+    if metrics is not None:
+        print(metrics.render(), end="")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# tested in Python 3.6+
+# required packages: none (standard library only)
+
+"""Dispatch of received frames by reference id.
+
+Control messages have reference ids starting with an underscore and are handled by
+dedicated handlers:
+
+- `_heartbeat`: sent when there is no data for a subscription, only the time of arrival
+  is recorded so the payload is never decoded
+- `_resetsubscriptions`: the payload lists the reference ids that have to be recreated
+- `_disconnect`: the server asks the client to disconnect
+
+Data frames are decoded and handed to the handler registered for their reference id.
+With a BatchDecoder (see batch_decoder.py), `route_message()` decodes the data frames of
+a whole websocket message at once.
+"""
+
+import asyncio
+import json
+import logging
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Union
+
+from batch_decoder import NOT_DECODED, BatchDecoder, Message, scan_frames
+from frame_parser import Frame
+from metrics import (
+    DECODE_ERRORS_TOTAL,
+    DECODE_SECONDS,
+    FRAME_BYTES_TOTAL,
+    FRAMES_TOTAL,
+    HEARTBEAT_INTERVAL_SECONDS,
+    MESSAGE_DECODE_SECONDS,
+    Metrics,
+    observe_server_lag,
+)
+from payload_decoder import PayloadDecodeError, PayloadDecoder
+from sinks import StreamMessage
+
+# a callback can either be a regular function or a coroutine function
+Callback = Callable[..., Union[None, Awaitable[None]]]
+
+
+def new_reference_id() -> str:
+    """Random reference id of a subscription, never mistaken for a control message."""
+
+    # token_urlsafe() may start with "_" (or "-"), hex digits after a letter can't
+    return "r" + secrets.token_hex(4)
+
+
+class MessageRouter:
+    """Routes frames to control handlers or to the data handler of their subscription.
+
+    `on_reset_subscriptions(ref_ids)` receives the registered reference ids that were
+    reset by the server, and may be a coroutine function - it is then scheduled as a
+    task so the reader never waits.
+
+    With `metrics` (see metrics.py), frames, payload bytes, decode time, server lag and
+    heartbeat intervals are recorded.
+
+    With a `batch_decoder`, `route_message()` decodes all frames of a message in one
+    batch. Pass the same PayloadDecoder to both, so protobuf schemas registered on the
+    decoder are used by the batch decoder.
+    """
+
+    def __init__(
+        self,
+        decoder: Optional[PayloadDecoder] = None,
+        on_reset_subscriptions: Optional[Callback] = None,
+        metrics: Optional[Metrics] = None,
+        batch_decoder: Optional[BatchDecoder] = None,
+    ):
+        self.decoder = decoder if decoder is not None else PayloadDecoder()
+        self.metrics = metrics
+        self.batch_decoder = batch_decoder
+        self.last_heartbeat: Optional[float] = None
+        self.unrouted = 0
+        self._handlers: Dict[str, Callable[[StreamMessage], None]] = {}
+        self._on_reset_subscriptions = on_reset_subscriptions
+        self._control_handlers: Dict[str, Callable[[Frame], None]] = {
+            "_heartbeat": self._handle_heartbeat,
+            "_resetsubscriptions": self._handle_reset_subscriptions,
+        }
+        self._tasks: Set["asyncio.Future[None]"] = set()
+
+    @property
+    def ref_ids(self) -> List[str]:
+        return list(self._handlers)
+
+    def register(self, ref_id: str, handler: Callable[[StreamMessage], None]) -> None:
+        """Send the decoded messages of `ref_id` to `handler`, like `sink.send`."""
+
+        self._handlers[ref_id] = handler
+
+    def unregister(self, ref_id: str) -> None:
+        self._handlers.pop(ref_id, None)
+
+    def set_control_handler(
+        self, ref_id: str, handler: Callable[[Frame], None]
+    ) -> None:
+        self._control_handlers[ref_id] = handler
+
+    def seconds_since_heartbeat(self) -> Optional[float]:
+        if self.last_heartbeat is None:
+            return None
+        return time.monotonic() - self.last_heartbeat
+
+    def route_message(self, message: Message) -> Iterator[int]:
+        """Route every frame of a message, and yield its message id after it is routed.
+
+        Stop iterating to skip the remaining frames of the message.
+        """
+
+        metrics = self.metrics
+        handlers = self._handlers
+        control_handlers = self._control_handlers
+        if self.batch_decoder is None:
+            # frames are routed straight from the index, without a Frame per data frame
+            index = scan_frames(message)
+            decode = self.decoder.decode_payload
+            for i, (msg_id, ref_id, payload_format, start, end) in enumerate(
+                zip(*index)
+            ):
+                if metrics is not None:
+                    metrics.inc(FRAMES_TOTAL, ref_id=ref_id)
+                    metrics.inc(FRAME_BYTES_TOTAL, end - start, ref_id=ref_id)
+
+                # data frames are the common case, control handlers are looked up last
+                handler = handlers.get(ref_id)
+                if handler is None:
+                    control_handler = control_handlers.get(ref_id)
+                    if control_handler is not None:
+                        control_handler(index.frame(message, i))
+                    else:
+                        self.unrouted += 1
+                    yield msg_id
+                    continue
+
+                decode_start = time.perf_counter() if metrics is not None else 0.0
+                try:
+                    data = decode(ref_id, payload_format, message[start:end])
+                except PayloadDecodeError as error:
+                    logging.warning(f"could not decode message {msg_id}: {error}")
+                    if metrics is not None:
+                        metrics.inc(DECODE_ERRORS_TOTAL, ref_id=ref_id)
+                else:
+                    if metrics is not None:
+                        metrics.observe(
+                            DECODE_SECONDS, time.perf_counter() - decode_start
+                        )
+                        observe_server_lag(metrics, data)
+                    handler(StreamMessage(msg_id, ref_id, data))
+                yield msg_id
+            return
+
+        start = time.perf_counter() if metrics is not None else 0.0
+        index, decoded = self.batch_decoder.decode(message, handlers)
+        if metrics is not None:
+            # the decode time is only known per message, not per payload
+            metrics.observe(MESSAGE_DECODE_SECONDS, time.perf_counter() - start)
+
+        for i, (msg_id, ref_id, data) in enumerate(
+            zip(index.msg_ids, index.ref_ids, decoded)
+        ):
+            if metrics is not None:
+                metrics.inc(FRAMES_TOTAL, ref_id=ref_id)
+                metrics.inc(
+                    FRAME_BYTES_TOTAL, index.ends[i] - index.starts[i], ref_id=ref_id
+                )
+
+            control_handler = control_handlers.get(ref_id)
+            handler = handlers.get(ref_id)
+            if control_handler is not None:
+                control_handler(index.frame(message, i))
+            elif handler is None or data is NOT_DECODED:
+                self.unrouted += 1
+            elif isinstance(data, PayloadDecodeError):
+                logging.warning(f"could not decode message {msg_id}: {data}")
+                if metrics is not None:
+                    metrics.inc(DECODE_ERRORS_TOTAL, ref_id=ref_id)
+            else:
+                if metrics is not None:
+                    observe_server_lag(metrics, data)
+                handler(StreamMessage(msg_id, ref_id, data))
+            yield msg_id
+
+    def route(self, frame: Frame) -> None:
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.inc(FRAMES_TOTAL, ref_id=frame.ref_id)
+            metrics.inc(FRAME_BYTES_TOTAL, len(frame.payload), ref_id=frame.ref_id)
+
+        control_handler = self._control_handlers.get(frame.ref_id)
+        if control_handler is not None:
+            control_handler(frame)
+            return
+
+        handler = self._handlers.get(frame.ref_id)
+        if handler is None:
+            self.unrouted += 1
+            return
+
+        start = time.perf_counter() if metrics is not None else 0.0
+        try:
+            data = self.decoder.decode(frame)
+        except PayloadDecodeError as error:
+            logging.warning(f"could not decode message {frame.msg_id}: {error}")
+            if metrics is not None:
+                metrics.inc(DECODE_ERRORS_TOTAL, ref_id=frame.ref_id)
+            return
+        if metrics is not None:
+            metrics.observe(DECODE_SECONDS, time.perf_counter() - start)
+            observe_server_lag(metrics, data)
+        handler(StreamMessage(frame.msg_id, frame.ref_id, data))
+
+    def _handle_heartbeat(self, frame: Frame) -> None:
+        now = time.monotonic()
+        if self.metrics is not None and self.last_heartbeat is not None:
+            self.metrics.observe(HEARTBEAT_INTERVAL_SECONDS, now - self.last_heartbeat)
+        self.last_heartbeat = now
+
+    def _handle_reset_subscriptions(self, frame: Frame) -> None:
+        payload = json.loads(str(frame.payload, "utf-8"))
+        # without target reference ids, all subscriptions have to be reset
+        targets = payload.get("TargetReferenceIds") or self.ref_ids
+        ref_ids = [ref_id for ref_id in targets if ref_id in self._handlers]
+        logging.warning(f"server reset subscriptions: {ref_ids}")
+        if ref_ids and self._on_reset_subscriptions is not None:
+            self._schedule(self._on_reset_subscriptions(ref_ids))
+
+    def _schedule(self, result: Any) -> None:
+        if asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
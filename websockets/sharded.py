@@ -0,0 +1,478 @@
+# tested in Python 3.6+
+# required packages: websockets, aiohttp
+
+"""Streaming over several connections, each decoded in its own worker process.
+
+A single connection is read and decoded by one Python thread, which limits the number of
+frames per second a client can handle. The ShardedStreamer splits the instruments over
+`shards` worker processes instead:
+
+- every worker has its own context id, websocket connection (a ReconnectingStreamer),
+  SubscriptionManager and decoders, so frames are parsed and decoded on as many cores as
+  there are workers
+- the decoded messages of a worker are sent to the supervisor in one batch per websocket
+  message, and the supervisor passes the messages of all workers to a single handler on
+  its event loop, so the consumer sees one stream (messages of one worker stay in order,
+  messages of different workers are interleaved)
+- workers that exit are restarted after `restart_delay` seconds, with a new context id,
+  and subscribe to their instruments again (a new snapshot is sent)
+- `rebalance(uics)` changes the instruments of the stream, moving as few of them between
+  workers as possible to keep the number of instruments per worker even
+
+Workers are started with the "spawn" method, so the main module of the program must be
+importable without side effects (use `if __name__ == "__main__":`).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from async_client import SIM_BASE_URL, OpenAPIClient
+from batch_decoder import BatchDecoder
+from metrics import SHARD_INSTRUMENTS, SHARD_RESTARTS_TOTAL, SHARD_RUNNING, Metrics
+from payload_decoder import PayloadDecoder
+from pipeline import Pipeline
+from reconnect import SIM_STREAMING_URL, ReconnectingStreamer
+from router import MessageRouter
+from sinks import Sink, StreamMessage
+from subscription_manager import Subscription, SubscriptionManager, SubscriptionState
+
+# messages from the workers to the supervisor: (kind, shard index, payload)
+MESSAGES = "messages"
+SNAPSHOT = "snapshot"
+ERROR = "error"
+
+# commands from the supervisor to a worker: (kind, argument)
+SUBSCRIBE = "subscribe"  # list of uics
+UNSUBSCRIBE = "unsubscribe"  # list of uics
+TOKEN = "token"  # refreshed access token
+STOP = "stop"  # no argument
+
+# seconds a worker waits for a command before it checks whether it was stopped
+_COMMAND_POLL_INTERVAL = 0.5
+
+
+class ShardConfig(NamedTuple):
+    """Everything a worker process needs to stream its instruments."""
+
+    index: int
+    context_id: str
+    token: str
+    uics: List[int]
+    base_url: str
+    url: str
+    asset_type: str
+    max_uics_per_subscription: int
+
+
+def balance(assignment: List[List[int]], uics: Iterable[int]) -> List[List[int]]:
+    """Assign `uics` to the shards of `assignment`, moving as few Uics as possible.
+
+    Removed Uics are dropped, new Uics go to the shard with the fewest instruments, and
+    Uics are moved from the largest to the smallest shard until they differ by at most
+    one instrument.
+    """
+
+    wanted = list(dict.fromkeys(uics))
+    keep = set(wanted)
+    shards = [[uic for uic in shard if uic in keep] for shard in assignment]
+    assigned = {uic for shard in shards for uic in shard}
+    for uic in wanted:
+        if uic not in assigned:
+            min(shards, key=len).append(uic)
+    while True:
+        smallest = min(shards, key=len)
+        largest = max(shards, key=len)
+        if len(largest) - len(smallest) <= 1:
+            return shards
+        smallest.append(largest.pop())
+
+
+class _Forwarder(Sink):
+    """Collects the messages of a worker, and puts them on the output queue in batches.
+
+    All frames of a websocket message are routed before the reader waits for the next
+    message, so the messages of a websocket message are sent to the supervisor as one
+    batch.
+    """
+
+    def __init__(self, index: int, output: Any):
+        self.index = index
+        self._output = output
+        self._batch: List[StreamMessage] = []
+
+    def send(self, message: StreamMessage) -> None:
+        if not self._batch:
+            asyncio.get_event_loop().call_soon(self.flush)
+        self._batch.append(message)
+
+    def flush(self) -> None:
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._output.put((MESSAGES, self.index, batch))
+
+
+class _ShardWorker:
+    def __init__(self, config: ShardConfig, output: Any, commands: Any):
+        self.config = config
+        self._output = output
+        self._commands = commands
+        self._forwarder = _Forwarder(config.index, output)
+        self._client = OpenAPIClient(config.token, config.base_url)
+        decoder = PayloadDecoder()
+        router = MessageRouter(
+            decoder,
+            lambda ref_ids: self._manager.reset(ref_ids),
+            batch_decoder=BatchDecoder(decoder),
+        )
+        self._manager = SubscriptionManager(
+            self._client,
+            config.context_id,
+            router,
+            asset_type=config.asset_type,
+            max_uics_per_subscription=config.max_uics_per_subscription,
+            on_snapshot=self._on_snapshot,
+        )
+        self._streamer = ReconnectingStreamer(
+            config.context_id,
+            config.token,
+            router,
+            self._on_connected,
+            url=config.url,
+        )
+        # instruments to subscribe to once connected (commands may change them first)
+        self._uics = list(config.uics)
+        self._subscribed = False
+        self._stopped = False
+
+    async def run(self) -> None:
+        commands = asyncio.ensure_future(self._read_commands())
+        try:
+            await self._streamer.run()
+        finally:
+            self._stopped = True
+            await commands
+            await self._manager.unsubscribe_all()
+            await self._client.close()
+            self._forwarder.flush()
+
+    async def _on_connected(self, resumed: bool) -> None:
+        if not self._subscribed:
+            self._subscribed = True
+            await self._manager.subscribe(self._uics, self._forwarder.send)
+        elif not resumed:
+            await self._manager.resubscribe_all()
+
+    def _on_snapshot(
+        self, subscription: Subscription, snapshot: Dict[str, Any]
+    ) -> None:
+        # deltas received before the snapshot are passed on before it
+        self._forwarder.flush()
+        self._output.put(
+            (
+                SNAPSHOT,
+                self.config.index,
+                (subscription.ref_id, subscription.uics, snapshot),
+            )
+        )
+
+    async def _read_commands(self) -> None:
+        loop = asyncio.get_event_loop()
+        while not self._stopped:
+            command = await loop.run_in_executor(None, self._next_command)
+            if command is None:
+                continue
+            kind, argument = command
+            if kind == STOP:
+                await self._streamer.stop()
+                return
+            if kind == TOKEN:
+                self._streamer.token = argument
+                self._client.token = argument
+                continue
+            try:
+                if kind == SUBSCRIBE:
+                    if self._subscribed:
+                        await self._manager.subscribe(argument, self._forwarder.send)
+                    else:
+                        self._uics.extend(argument)
+                elif kind == UNSUBSCRIBE:
+                    if self._subscribed:
+                        await self._manager.unsubscribe_uics(argument)
+                    else:
+                        self._uics = [uic for uic in self._uics if uic not in argument]
+            except Exception:
+                logging.exception(
+                    f"shard {self.config.index} could not {kind} {argument}"
+                )
+
+    def _next_command(self) -> Any:
+        try:
+            return self._commands.get(timeout=_COMMAND_POLL_INTERVAL)
+        except queue.Empty:
+            return None
+
+
+def run_shard(config: ShardConfig, output: Any, commands: Any) -> None:
+    """Entry point of a worker process: stream the instruments of one shard."""
+
+    # the supervisor decides when the workers stop, also on Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(_ShardWorker(config, output, commands).run())
+    except Exception as error:
+        output.put((ERROR, config.index, repr(error)))
+        raise
+    finally:
+        loop.close()
+
+
+class _Shard:
+    __slots__ = ("index", "context_id", "process", "commands", "exited")
+
+    def __init__(self, index: int, context_id: str, process: Any, commands: Any):
+        self.index = index
+        self.context_id = context_id
+        self.process = process
+        self.commands = commands
+        self.exited: Optional[float] = None
+
+
+class ShardedStreamer:
+    """Streams `uics` over `shards` connections in worker processes.
+
+    Every decoded message is passed to `handler` on the event loop of the supervisor,
+    and `on_snapshot(subscription, snapshot)` is called with the snapshot of every
+    subscription a worker creates. `shards` defaults to the number of CPUs.
+
+    At most `max_pending` batches of messages wait for the supervisor. With a `pipeline`
+    (see pipeline.py) the supervisor takes the next batch only when the pipeline has
+    room, so when the handler lags the queue fills up and the workers stop reading
+    their connections, like a single ReconnectingStreamer does.
+
+    Pass a refreshed access token to `update_token()`, the workers use it for their
+    REST requests and reconnects (and workers started later use it as well).
+    """
+
+    def __init__(
+        self,
+        token: str,
+        uics: Iterable[int],
+        handler: Callable[[StreamMessage], None],
+        shards: Optional[int] = None,
+        on_snapshot: Optional[Callable[[Subscription, Dict[str, Any]], None]] = None,
+        base_url: str = SIM_BASE_URL,
+        url: str = SIM_STREAMING_URL,
+        asset_type: str = "FxSpot",
+        max_uics_per_subscription: int = 200,
+        restart_delay: float = 5.0,
+        check_interval: float = 1.0,
+        metrics: Optional[Metrics] = None,
+        pipeline: Optional[Pipeline] = None,
+        max_pending: int = 100,
+    ):
+        shards = shards or os.cpu_count() or 1
+        self.token = token
+        self.handler = handler
+        self.base_url = base_url
+        self.url = url
+        self.asset_type = asset_type
+        self.max_uics_per_subscription = max_uics_per_subscription
+        self.restart_delay = restart_delay
+        self.check_interval = check_interval
+        self.metrics = metrics
+        self.pipeline = pipeline
+        self.assignment = balance([[] for _ in range(shards)], uics)
+        self.restarts = 0
+        self._on_snapshot = on_snapshot
+        self._context = multiprocessing.get_context("spawn")
+        self._output = self._context.Queue(max_pending)
+        self._shards: List[_Shard] = []
+        self._stopping = False
+        self._stop_event: Optional[asyncio.Event] = None
+        self._reader: Optional[threading.Thread] = None
+
+    @property
+    def context_ids(self) -> List[str]:
+        return [shard.context_id for shard in self._shards]
+
+    async def run(self) -> None:
+        """Start the workers, and restart the ones that exit, until `stop()`."""
+
+        self._stop_event = asyncio.Event()
+        self._reader = threading.Thread(
+            target=self._read_output,
+            args=(asyncio.get_event_loop(), self._stop_event),
+            name="shard-output",
+            daemon=True,
+        )
+        self._reader.start()
+        self._shards = [self._start(index) for index in range(len(self.assignment))]
+
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+            if not self._stopping:
+                self._check()
+
+    def rebalance(self, uics: Iterable[int]) -> None:
+        """Stream `uics` from now on, moving instruments between workers if needed."""
+
+        assignment = balance(self.assignment, uics)
+        for index, (old, new) in enumerate(zip(self.assignment, assignment)):
+            old_uics, new_uics = set(old), set(new)
+            added = [uic for uic in new if uic not in old_uics]
+            removed = [uic for uic in old if uic not in new_uics]
+            # a moved instrument is subscribed to by its new shard first, so no delta
+            # is missed (but some may be received twice)
+            if added:
+                self._send(index, SUBSCRIBE, added)
+            if removed:
+                self._send(index, UNSUBSCRIBE, removed)
+            if self.metrics is not None:
+                self.metrics.set(SHARD_INSTRUMENTS, len(new), shard=str(index))
+        self.assignment = assignment
+
+    def update_token(self, token: str) -> None:
+        """Use `token` from now on, in all workers."""
+
+        self.token = token
+        for shard in self._shards:
+            shard.commands.put((TOKEN, token))
+
+    async def stop(self) -> None:
+        """Stop the workers (deleting their subscriptions) and wait until they exit."""
+
+        self._stopping = True
+        if self._stop_event is not None:
+            self._stop_event.set()
+        for shard in self._shards:
+            shard.commands.put((STOP, None))
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._join)
+        # all messages of the workers are in the queue before this, so none are lost
+        # (the queue may be full, and the reader needs the loop to empty it)
+        await loop.run_in_executor(None, self._output.put, None)
+        if self._reader is not None:
+            await loop.run_in_executor(None, self._reader.join)
+
+    def _start(self, index: int) -> _Shard:
+        context_id = secrets.token_urlsafe(10)
+        config = ShardConfig(
+            index,
+            context_id,
+            self.token,
+            self.assignment[index],
+            self.base_url,
+            self.url,
+            self.asset_type,
+            self.max_uics_per_subscription,
+        )
+        commands = self._context.Queue()
+        process = self._context.Process(
+            target=run_shard,
+            args=(config, self._output, commands),
+            name=f"shard-{index}",
+            daemon=True,
+        )
+        process.start()
+        logging.debug(f"started shard {index} with context {context_id}")
+        if self.metrics is not None:
+            self.metrics.set(SHARD_RUNNING, 1, shard=str(index))
+            self.metrics.set(SHARD_INSTRUMENTS, len(config.uics), shard=str(index))
+        return _Shard(index, context_id, process, commands)
+
+    def _check(self) -> None:
+        """Restart the workers that exited at least `restart_delay` seconds ago."""
+
+        for shard in self._shards:
+            if shard.process.is_alive():
+                continue
+            if shard.exited is None:
+                shard.exited = time.monotonic()
+                logging.warning(
+                    f"shard {shard.index} exited with code {shard.process.exitcode}, "
+                    f"restarting in {self.restart_delay} seconds"
+                )
+                if self.metrics is not None:
+                    self.metrics.set(SHARD_RUNNING, 0, shard=str(shard.index))
+            elif time.monotonic() - shard.exited >= self.restart_delay:
+                self._shards[shard.index] = self._start(shard.index)
+                self.restarts += 1
+                if self.metrics is not None:
+                    self.metrics.inc(SHARD_RESTARTS_TOTAL, shard=str(shard.index))
+
+    def _send(self, index: int, kind: str, uics: List[int]) -> None:
+        if self._shards:
+            self._shards[index].commands.put((kind, uics))
+
+    def _join(self, timeout: float = 10.0) -> None:
+        for shard in self._shards:
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                logging.warning(f"shard {shard.index} did not stop, terminating it")
+                shard.process.terminate()
+                shard.process.join()
+            if self.metrics is not None:
+                self.metrics.set(SHARD_RUNNING, 0, shard=str(shard.index))
+
+    def _read_output(
+        self, loop: asyncio.AbstractEventLoop, stop_event: asyncio.Event
+    ) -> None:
+        """Hand everything the workers send to the event loop (runs in a thread)."""
+
+        while True:
+            item = self._output.get()
+            if item is None:
+                return
+            try:
+                if self.pipeline is None:
+                    loop.call_soon_threadsafe(self._deliver, item)
+                else:
+                    asyncio.run_coroutine_threadsafe(
+                        self._deliver_when_ready(item, self.pipeline, stop_event), loop
+                    ).result()
+            except RuntimeError:
+                # the event loop was closed
+                return
+
+    async def _deliver_when_ready(
+        self, item: Any, pipeline: Pipeline, stop_event: asyncio.Event
+    ) -> None:
+        """Deliver `item`, and wait until the pipeline has room for the next batch."""
+
+        self._deliver(item)
+        if self._stopping or len(pipeline) < pipeline.maxsize:
+            return
+        capacity = asyncio.ensure_future(pipeline.wait_for_capacity())
+        stopped = asyncio.ensure_future(stop_event.wait())
+        # a pipeline that is no longer consumed must not keep stop() waiting
+        await asyncio.wait([capacity, stopped], return_when=asyncio.FIRST_COMPLETED)
+        capacity.cancel()
+        stopped.cancel()
+
+    def _deliver(self, item: Any) -> None:
+        kind, index, payload = item
+        if kind == MESSAGES:
+            handler = self.handler
+            for message in payload:
+                handler(message)
+        elif kind == SNAPSHOT:
+            if self._on_snapshot is not None:
+                ref_id, uics, snapshot = payload
+                subscription = Subscription(ref_id, uics, self.handler)
+                subscription.state = SubscriptionState.ACTIVE
+                self._on_snapshot(subscription, snapshot)
+        elif kind == ERROR:
+            logging.error(f"shard {index} failed: {payload}")
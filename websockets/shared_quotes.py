@@ -0,0 +1,302 @@
+# tested in Python 3.8+
+# required packages: none (standard library only)
+
+"""Latest quote per instrument in shared memory, for other processes on this machine.
+
+One process holds the streaming connection and publishes the latest quote of every
+instrument into a `multiprocessing.shared_memory` block. Any number of local processes
+attach to the block by name and read quotes directly from memory, without a websocket
+connection (and context id) of their own and without serializing anything between the
+processes.
+
+The block consists of a header followed by `capacity` slots of 64 bytes, one per
+instrument:
+
+    header: | magic (8) | capacity (4) | used slots (4) | version (8) | padding (40) |
+    slot:   | sequence (8) | uic (8) | flags (4) | padding (4) |
+            | bid | ask | mid | amount | last_updated |  (8 each)
+
+Quote fields are doubles (NaN when unknown), `last_updated` is in seconds since the
+epoch. Slots are assigned to instruments in the order they are first published and never
+move, so readers only have to look up the slot of an instrument once. `version` is
+incremented after every update, so a reader can cheaply check whether anything changed.
+
+Every slot is protected by a seqlock: the writer makes the sequence odd before and even
+after updating the slot, and a reader retries when the sequence was odd or changed while
+it read the slot. The single writer never waits for readers, and readers never see a
+partially updated quote.
+
+Note that Python has no memory barriers, so the seqlock relies on the stores of the
+writer becoming visible to readers in program order, and on the loads of a reader not
+being reordered, as guaranteed by x86 (TSO). On CPUs with weaker memory ordering (such
+as ARM) a reader may accept a slot that was partially updated, so use the shared quotes
+on x86 only.
+"""
+
+import math
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, NamedTuple, Optional
+
+from metrics import parse_timestamp
+from price_store import InfoPriceStore, PriceRecord
+
+MAGIC = b"SAXOQTS1"
+
+HEADER = struct.Struct("<8sIIQ40x")
+SEQUENCE = struct.Struct("<Q")
+# uic, flags, bid, ask, mid, amount, last_updated - stored after the sequence of a slot
+SLOT_VALUES = struct.Struct("<qI4xddddd")
+SLOT_SIZE = SEQUENCE.size + SLOT_VALUES.size
+
+# offsets of the used slot count and the version in the header
+_USED_OFFSET = 12
+_VERSION_OFFSET = 16
+
+# reads of a slot that is being updated are retried right away this many times, and
+# after that every _BACKOFF seconds, so the writer can finish the update also when it
+# shares a CPU with the reader
+_SPINS = 100
+_BACKOFF = 0.00005
+
+# the instrument was deleted from the subscription, its quote is no longer valid
+FLAG_DELETED = 1
+
+
+class SharedQuote(NamedTuple):
+    uic: int
+    bid: float
+    ask: float
+    mid: float
+    amount: float
+    last_updated: float
+
+
+class SharedQuoteError(RuntimeError):
+    pass
+
+
+class SharedQuoteWriter:
+    """Publishes the latest quote of every instrument in `store` to the block `name`.
+
+    The writer is the `on_update` callback of the InfoPriceStore, so deltas are merged
+    once, by the store, and every update publishes the complete quote of the record.
+    Keep sending snapshots and deltas to the store as usual. The block is removed when
+    the writer is closed.
+
+    A block that still exists is only replaced with `replace=True`, for example after
+    the previous writer crashed. Readers attached to the old block have to attach again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        store: InfoPriceStore,
+        capacity: int = 4096,
+        replace: bool = False,
+    ):
+        if store.on_update is not None:
+            raise ValueError("the store already has an on_update callback")
+        self.name = name
+        self.capacity = capacity
+        self.store = store
+        if replace:
+            _remove(name)
+        self._memory = shared_memory.SharedMemory(
+            name, create=True, size=HEADER.size + capacity * SLOT_SIZE
+        )
+        self._buffer = self._memory.buf
+        self._slots: Dict[int, int] = {}
+        self._sequences: List[int] = [0] * capacity
+        self._version = 0
+        HEADER.pack_into(self._buffer, 0, MAGIC, capacity, 0, 0)
+        for record in store:
+            self._publish(record)
+        store.on_update = self.publish
+
+    def publish(self, uic: int, record: Optional[PriceRecord]) -> None:
+        """Publish the quote of an updated record, or mark a removed one deleted."""
+
+        if record is None:
+            self._publish_deleted(uic)
+        else:
+            self._publish(record)
+
+    def close(self) -> None:
+        if self.store.on_update == self.publish:
+            self.store.on_update = None
+        self._buffer = None
+        self._memory.close()
+        self._memory.unlink()
+
+    def _publish(self, record: PriceRecord) -> None:
+        try:
+            last_updated = (
+                parse_timestamp(record.last_updated)
+                if record.last_updated
+                else math.nan
+            )
+        except ValueError:
+            last_updated = math.nan
+        self._write(
+            record.uic,
+            0,
+            _float(record.bid),
+            _float(record.ask),
+            _float(record.mid),
+            _float(record.amount),
+            last_updated,
+        )
+
+    def _publish_deleted(self, uic: int) -> None:
+        if uic in self._slots:
+            nan = math.nan
+            self._write(uic, FLAG_DELETED, nan, nan, nan, nan, nan)
+
+    def _write(self, uic: int, flags: int, *values: float) -> None:
+        slot = self._slots.get(uic)
+        if slot is None:
+            slot = self._allocate(uic)
+        offset = HEADER.size + slot * SLOT_SIZE
+        buffer = self._buffer
+        sequence = self._sequences[slot] + 1
+        SEQUENCE.pack_into(buffer, offset, sequence)
+        SLOT_VALUES.pack_into(buffer, offset + SEQUENCE.size, uic, flags, *values)
+        SEQUENCE.pack_into(buffer, offset, sequence + 1)
+        self._sequences[slot] = sequence + 1
+        self._version += 1
+        SEQUENCE.pack_into(buffer, _VERSION_OFFSET, self._version)
+
+    def _allocate(self, uic: int) -> int:
+        slot = len(self._slots)
+        if slot >= self.capacity:
+            raise SharedQuoteError(
+                f"no free slot for uic {uic}, "
+                f"the capacity of {self.name} is {self.capacity}"
+            )
+        # the slot is written (without a quote) before the used slot count makes it
+        # visible to readers
+        offset = HEADER.size + slot * SLOT_SIZE
+        SEQUENCE.pack_into(self._buffer, offset, 0)
+        SLOT_VALUES.pack_into(
+            self._buffer, offset + SEQUENCE.size, uic, FLAG_DELETED, *([math.nan] * 5)
+        )
+        self._sequences[slot] = 0
+        self._slots[uic] = slot
+        struct.pack_into("<I", self._buffer, _USED_OFFSET, slot + 1)
+        return slot
+
+
+class SharedQuoteReader:
+    """Reads quotes from the shared memory block `name` of a SharedQuoteWriter.
+
+    A read raises SharedQuoteError when a slot could not be read consistently for
+    `timeout` seconds.
+    """
+
+    def __init__(self, name: str, timeout: float = 1.0):
+        self.name = name
+        self.timeout = timeout
+        self._memory = _attach(name)
+        self._buffer = self._memory.buf
+        magic, self.capacity, _, _ = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            self.close()
+            raise SharedQuoteError(f"{name} is not a shared quote table")
+        self._slots: Dict[int, int] = {}
+        self._scanned = 0
+
+    @property
+    def version(self) -> int:
+        """Incremented by the writer after every update."""
+
+        return SEQUENCE.unpack_from(self._buffer, _VERSION_OFFSET)[0]
+
+    def get(self, uic: int) -> Optional[SharedQuote]:
+        """Latest quote of `uic`, or None when it was not published (or was deleted)."""
+
+        slot = self._slots.get(uic)
+        if slot is None:
+            self._scan()
+            slot = self._slots.get(uic)
+            if slot is None:
+                return None
+        return self._read(slot)
+
+    def quotes(self) -> Dict[int, SharedQuote]:
+        """Latest quotes of all published instruments."""
+
+        self._scan()
+        quotes = {}
+        for uic, slot in self._slots.items():
+            quote = self._read(slot)
+            if quote is not None:
+                quotes[uic] = quote
+        return quotes
+
+    def close(self) -> None:
+        self._buffer = None
+        self._memory.close()
+
+    def _scan(self) -> None:
+        """Look up the slots that were assigned since the last scan."""
+
+        used = struct.unpack_from("<I", self._buffer, _USED_OFFSET)[0]
+        for slot in range(self._scanned, used):
+            offset = HEADER.size + slot * SLOT_SIZE + SEQUENCE.size
+            uic = SLOT_VALUES.unpack_from(self._buffer, offset)[0]
+            self._slots[uic] = slot
+        self._scanned = used
+
+    def _read(self, slot: int) -> Optional[SharedQuote]:
+        buffer = self._buffer
+        offset = HEADER.size + slot * SLOT_SIZE
+        unpack_sequence = SEQUENCE.unpack_from
+        unpack_values = SLOT_VALUES.unpack_from
+        attempt = 0
+        deadline = 0.0
+        while True:
+            before = unpack_sequence(buffer, offset)[0]
+            if not before & 1:
+                uic, flags, *values = unpack_values(buffer, offset + SEQUENCE.size)
+                if unpack_sequence(buffer, offset)[0] == before:
+                    return None if flags & FLAG_DELETED else SharedQuote(uic, *values)
+
+            attempt += 1
+            if attempt < _SPINS:
+                continue
+            # the writer was interrupted in the middle of an update, let it run
+            if not deadline:
+                deadline = time.monotonic() + self.timeout
+            elif time.monotonic() > deadline:
+                raise SharedQuoteError(
+                    f"slot {slot} of {self.name} was not readable "
+                    f"for {self.timeout} seconds"
+                )
+            time.sleep(_BACKOFF)
+
+
+def _float(value: Optional[float]) -> float:
+    return math.nan if value is None else value
+
+
+def _remove(name: str) -> None:
+    try:
+        memory = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    memory.close()
+    memory.unlink()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    memory = shared_memory.SharedMemory(name)
+    # before Python 3.13 the resource tracker removes the block when the reader exits
+    # (bpo-38119), even though it is owned by the writer
+    tracked_name = memory._name  # type: ignore[attr-defined]
+    resource_tracker.unregister(tracked_name, "shared_memory")
+    return memory
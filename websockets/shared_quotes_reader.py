@@ -0,0 +1,76 @@
+# tested in Python 3.8+
+# required packages: none (standard library only)
+
+"""Print the quotes that websockets-sample.py publishes to shared memory.
+
+Set SHARED_QUOTES_NAME in websockets-sample.py to publish them.
+
+Any number of these readers can run next to the sample, without a websocket connection
+of their own:
+
+    python shared_quotes_reader.py saxo_quotes
+    python shared_quotes_reader.py saxo_quotes --uic 21 --interval 0.5
+"""
+
+import argparse
+import math
+import sys
+import time
+
+from shared_quotes import SharedQuoteReader
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "name", help="name of the shared memory block (SHARED_QUOTES_NAME)"
+    )
+    parser.add_argument(
+        "--uic", type=int, action="append", help="only print these instruments"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="seconds between checks for updates"
+    )
+    args = parser.parse_args()
+
+    try:
+        reader = SharedQuoteReader(args.name)
+    except FileNotFoundError:
+        print(f"No shared quotes named {args.name} - is the streaming sample running?")
+        return 1
+
+    version = -1
+    try:
+        while True:
+            # the version changes with every update, so nothing is read while the quotes
+            # are unchanged
+            if reader.version != version:
+                version = reader.version
+                if args.uic:
+                    quotes = [reader.get(uic) for uic in args.uic]
+                else:
+                    quotes = list(reader.quotes().values())
+                for quote in quotes:
+                    if quote is None:
+                        continue
+                    updated = (
+                        ""
+                        if math.isnan(quote.last_updated)
+                        else time.strftime(
+                            " (%H:%M:%S)", time.gmtime(quote.last_updated)
+                        )
+                    )
+                    print(
+                        f"{quote.uic}: bid {quote.bid} ask {quote.ask} "
+                        f"mid {quote.mid}{updated}"
+                    )
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
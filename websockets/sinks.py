@@ -0,0 +1,181 @@
+# tested in Python 3.6+
+# required packages: none (protobuf to write protobuf messages with BatchedFileSink)
+
+"""Sinks that receive decoded streaming messages from the websocket decode loop.
+
+The decode loop only hands each decoded message to a sink via `send()`, so it never
+performs blocking console or file I/O itself. Pick the sink that fits the consumer:
+
+- CallbackSink: call a function for every message (keep it fast!)
+- QueueSink: put messages on an asyncio.Queue for a consumer coroutine
+- RingBufferSink: keep only the latest N messages in memory
+- BatchedFileSink: append messages as JSON lines to a file, written in batches
+- PrintSink: pretty-print messages from a background thread (useful for demos)
+- FanOutSink: deliver every message to multiple sinks
+"""
+
+import asyncio
+import json
+import queue
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from pprint import pprint
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, TextIO
+
+try:
+    from google.protobuf.json_format import MessageToDict
+    from google.protobuf.message import Message as ProtobufMessage
+except ImportError:
+    # without protobuf no protobuf payloads are decoded, so none has to be written
+    ProtobufMessage = None  # type: ignore[misc,assignment]
+
+
+class StreamMessage(NamedTuple):
+    """A decoded message from a streaming subscription (or control message)."""
+
+    msg_id: int
+    ref_id: str
+    data: Any
+
+
+class Sink(ABC):
+    """Base class for all sinks. Subclasses must implement `send()`."""
+
+    @abstractmethod
+    def send(self, message: StreamMessage) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class CallbackSink(Sink):
+    def __init__(self, callback: Callable[[StreamMessage], None]):
+        self._callback = callback
+
+    def send(self, message: StreamMessage) -> None:
+        self._callback(message)
+
+
+class QueueSink(Sink):
+    """Puts messages on an asyncio.Queue without awaiting.
+
+    If the queue is bounded and full, the message is dropped and counted in `dropped`.
+    """
+
+    def __init__(self, message_queue: Optional["asyncio.Queue[StreamMessage]"] = None):
+        self.queue = message_queue if message_queue is not None else asyncio.Queue()
+        self.dropped = 0
+
+    def send(self, message: StreamMessage) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+class RingBufferSink(Sink):
+    """Keeps the latest `size` messages, older messages are discarded."""
+
+    def __init__(self, size: int = 1024):
+        self._buffer: "deque[StreamMessage]" = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def send(self, message: StreamMessage) -> None:
+        self._buffer.append(message)
+
+    def drain(self) -> List[StreamMessage]:
+        """Return all buffered messages (oldest first) and empty the buffer."""
+
+        messages = list(self._buffer)
+        self._buffer.clear()
+        return messages
+
+
+class BatchedFileSink(Sink):
+    """Appends messages as JSON lines to a file, once every `batch_size` messages.
+
+    Protobuf payloads are written as their JSON mapping (like a JSON payload), other
+    data that can't be serialized to JSON raises a TypeError in `send()`.
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000):
+        self._file: TextIO = open(path, "a", encoding="utf-8")
+        self._batch_size = batch_size
+        self._batch: List[str] = []
+
+    def send(self, message: StreamMessage) -> None:
+        self._batch.append(
+            json.dumps(message._asdict(), separators=(",", ":"), default=_to_json)
+        )
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._batch:
+            self._batch.append("")  # terminate the last line
+            self._file.write("\n".join(self._batch))
+            self._file.flush()
+            self._batch = []
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+def _to_json(data: Any) -> Dict[str, Any]:
+    if ProtobufMessage is not None and isinstance(data, ProtobufMessage):
+        return MessageToDict(data)
+    raise TypeError(f"{type(data).__name__} can't be written as JSON")
+
+
+class PrintSink(Sink):
+    """Pretty-prints messages to the terminal from a background thread.
+
+    At most `max_pending` messages wait to be printed, when the terminal can't keep up
+    further messages are dropped and counted in `dropped`.
+    """
+
+    def __init__(self, max_pending: int = 1024) -> None:
+        self._queue: "queue.Queue[Optional[StreamMessage]]" = queue.Queue(max_pending)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._print_messages, daemon=True)
+        self._thread.start()
+
+    def send(self, message: StreamMessage) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        # blocks until the thread made room, so the messages before it are printed
+        self._queue.put(None)
+        self._thread.join()
+
+    def _print_messages(self) -> None:
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            print(
+                f"Received message {message.msg_id}, "
+                f"for subscription {message.ref_id}, with payload:"
+            )
+            pprint(message.data)
+
+
+class FanOutSink(Sink):
+    def __init__(self, *sinks: Sink):
+        self._sinks = sinks
+
+    def send(self, message: StreamMessage) -> None:
+        for sink in self._sinks:
+            sink.send(message)
+
+    def close(self) -> None:
+        for sink in self._sinks:
+            sink.close()
@@ -0,0 +1,198 @@
+# tested in Python 3.6+
+# required packages: aiohttp
+
+"""Management of many streaming subscriptions on a single context id.
+
+Instruments are split over as many subscriptions as needed to stay within the maximum
+number of Uics per subscription. Subscriptions are created and deleted concurrently
+through the async OpenAPI client, and their lifecycle (pending, active, failed, deleted)
+is tracked per reference id.
+"""
+
+import asyncio
+import logging
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from async_client import OpenAPIClient, OpenAPIError
+from payload_decoder import FORMAT_JSON, FORMAT_PROTOBUF
+from router import MessageRouter, new_reference_id
+from sinks import StreamMessage
+
+
+class SubscriptionState(Enum):
+    PENDING = "Pending"
+    ACTIVE = "Active"
+    FAILED = "Failed"
+    DELETED = "Deleted"
+
+
+class Subscription:
+    __slots__ = ("ref_id", "uics", "handler", "state", "error")
+
+    def __init__(
+        self, ref_id: str, uics: List[int], handler: Callable[[StreamMessage], None]
+    ):
+        self.ref_id = ref_id
+        self.uics = uics
+        self.handler = handler
+        self.state = SubscriptionState.PENDING
+        self.error: Optional[OpenAPIError] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"Subscription(ref_id={self.ref_id!r}, uics={len(self.uics)}, "
+            f"state={self.state.name})"
+        )
+
+
+class SubscriptionManager:
+    """Creates, tracks and deletes the subscriptions of one streaming context.
+
+    `on_snapshot(subscription, snapshot)` is called with the `Snapshot` of every
+    subscription that is created, for example to seed an InfoPriceStore.
+    """
+
+    def __init__(
+        self,
+        client: OpenAPIClient,
+        context_id: str,
+        router: MessageRouter,
+        asset_type: str = "FxSpot",
+        max_uics_per_subscription: int = 200,
+        payload_format: str = FORMAT_JSON,
+        service: str = "trade/v1/infoprices",
+        on_snapshot: Optional[Callable[[Subscription, Dict[str, Any]], None]] = None,
+    ):
+        self.client = client
+        self.context_id = context_id
+        self.router = router
+        self.asset_type = asset_type
+        self.max_uics_per_subscription = max_uics_per_subscription
+        self.payload_format = payload_format
+        self.service = service
+        self.subscriptions: Dict[str, Subscription] = {}
+        self._on_snapshot = on_snapshot
+
+    @property
+    def uics(self) -> List[int]:
+        return [uic for s in self.subscriptions.values() for uic in s.uics]
+
+    def get(self, ref_id: str) -> Optional[Subscription]:
+        return self.subscriptions.get(ref_id)
+
+    async def subscribe(
+        self, uics: Iterable[int], handler: Callable[[StreamMessage], None]
+    ) -> List[Subscription]:
+        """Subscribe to `uics` in batches and send all decoded messages to `handler`."""
+
+        uics = list(uics)
+        batch_size = self.max_uics_per_subscription
+        subscriptions = [
+            Subscription(new_reference_id(), uics[i : i + batch_size], handler)
+            for i in range(0, len(uics), batch_size)
+        ]
+        for subscription in subscriptions:
+            self.subscriptions[subscription.ref_id] = subscription
+        await asyncio.gather(*[self._create(s) for s in subscriptions])
+        return subscriptions
+
+    async def unsubscribe(self, ref_ids: Iterable[str]) -> None:
+        subscriptions = [self.subscriptions.pop(ref_id) for ref_id in ref_ids]
+        await asyncio.gather(*[self._delete(s) for s in subscriptions])
+
+    async def unsubscribe_all(self) -> None:
+        await self.unsubscribe(list(self.subscriptions))
+
+    async def unsubscribe_uics(self, uics: Iterable[int]) -> None:
+        """Stop receiving `uics`.
+
+        Their subscriptions are deleted, and created again for the remaining Uics.
+        """
+
+        removed = set(uics)
+        affected = [
+            s for s in self.subscriptions.values() if removed.intersection(s.uics)
+        ]
+        await self.unsubscribe([s.ref_id for s in affected])
+        for subscription in affected:
+            remaining = [uic for uic in subscription.uics if uic not in removed]
+            if remaining:
+                await self.subscribe(remaining, subscription.handler)
+
+    async def reset(self, ref_ids: Iterable[str]) -> None:
+        """Recreate subscriptions, after the server sent `_resetsubscriptions`."""
+
+        # a subscription may have been deleted since the server sent the reset
+        subscriptions = [
+            self.subscriptions[ref_id]
+            for ref_id in ref_ids
+            if ref_id in self.subscriptions
+        ]
+        await asyncio.gather(*[self._recreate(s) for s in subscriptions])
+
+    async def resubscribe_all(self) -> None:
+        """Create all subscriptions again, when the server dropped them.
+
+        For example after a `_disconnect` control message. Active subscriptions are
+        deleted first in case the server still holds them, pending subscriptions are
+        skipped as they are being created already.
+        """
+
+        subscriptions = [
+            s
+            for s in self.subscriptions.values()
+            if s.state is not SubscriptionState.PENDING
+        ]
+        await asyncio.gather(*[self._recreate(s) for s in subscriptions])
+
+    async def _recreate(self, subscription: Subscription) -> None:
+        await self._delete(subscription)
+        await self._create(subscription)
+
+    async def _create(self, subscription: Subscription) -> None:
+        subscription.state = SubscriptionState.PENDING
+        self.router.register(subscription.ref_id, subscription.handler)
+        try:
+            response = await self.client.create_subscription(
+                self.context_id,
+                subscription.ref_id,
+                {
+                    "AssetType": self.asset_type,
+                    "Uics": ",".join(str(uic) for uic in subscription.uics),
+                },
+                self.payload_format,
+                self.service,
+            )
+        except OpenAPIError as error:
+            self.router.unregister(subscription.ref_id)
+            subscription.state = SubscriptionState.FAILED
+            subscription.error = error
+            logging.error(
+                f"could not create subscription {subscription.ref_id}: {error}"
+            )
+            if error.status == 401:
+                raise
+            return
+
+        if self.payload_format == FORMAT_PROTOBUF:
+            self.router.decoder.register_schema(
+                subscription.ref_id, response["Schema"], response["SchemaName"]
+            )
+        subscription.state = SubscriptionState.ACTIVE
+        if self._on_snapshot is not None:
+            self._on_snapshot(subscription, response["Snapshot"])
+
+    async def _delete(self, subscription: Subscription) -> None:
+        self.router.unregister(subscription.ref_id)
+        self.router.decoder.unregister(subscription.ref_id)
+        if subscription.state is SubscriptionState.ACTIVE:
+            try:
+                await self.client.delete_subscription(
+                    self.context_id, subscription.ref_id, self.service
+                )
+            except OpenAPIError as error:
+                logging.warning(
+                    f"could not delete subscription {subscription.ref_id}: {error}"
+                )
+        subscription.state = SubscriptionState.DELETED
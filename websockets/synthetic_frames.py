@@ -0,0 +1,188 @@
+# tested in Python 3.6+
+# required packages: none (protobuf to generate decodable protobuf payloads)
+
+"""Synthetic websocket messages in the Saxo streaming envelope, for offline benchmarks.
+
+Messages contain batches of frames with a mix of reference id lengths, JSON InfoPrice
+deltas, protobuf payloads and heartbeats. See frame_parser.py for the byte layout of a
+frame.
+"""
+
+import json
+import random
+import struct
+from typing import Any, List, Optional, Sequence
+
+from frame_parser import FRAME_HEADER, PAYLOAD_FORMAT_JSON, PAYLOAD_HEADER
+
+PROTOBUF_MESSAGE_NAME = "SyntheticPrice"
+
+
+def encode_frame(
+    msg_id: int, ref_id: str, payload: bytes, payload_format: int = PAYLOAD_FORMAT_JSON
+) -> bytes:
+    encoded_ref_id = ref_id.encode("ascii")
+    return (
+        FRAME_HEADER.pack(msg_id, 0, len(encoded_ref_id))
+        + encoded_ref_id
+        + PAYLOAD_HEADER.pack(payload_format, len(payload))
+        + payload
+    )
+
+
+def json_delta(rng: random.Random, uics: Sequence[int]) -> bytes:
+    deltas = []
+    for uic in rng.sample(list(uics), rng.randint(1, min(5, len(uics)))):
+        bid = round(rng.uniform(0.5, 2.0), 5)
+        ask = round(bid + 0.0002, 5)
+        deltas.append(
+            {
+                "LastUpdated": "2022-01-17T12:11:29.620000Z",
+                "Quote": {"Ask": ask, "Bid": bid, "Mid": round((bid + ask) / 2, 6)},
+                "Uic": uic,
+            }
+        )
+    return json.dumps(deltas, separators=(",", ":")).encode()
+
+
+def heartbeat(ref_ids: Sequence[str]) -> bytes:
+    return json.dumps(
+        [
+            {
+                "ReferenceId": "_heartbeat",
+                "Heartbeats": [
+                    {"OriginatingReferenceId": ref_id, "Reason": "NoNewData"}
+                    for ref_id in ref_ids
+                ],
+            }
+        ],
+        separators=(",", ":"),
+    ).encode()
+
+
+def protobuf_message_class() -> Optional[Any]:
+    """Build the message class of protobuf payloads, returns None without protobuf."""
+
+    try:
+        from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+    except ImportError:
+        return None
+
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name="synthetic_price.proto", package="synthetic", syntax="proto3"
+    )
+    message_proto = file_proto.message_type.add(name=PROTOBUF_MESSAGE_NAME)
+    for number, (name, field_type) in enumerate(
+        [
+            ("Uic", descriptor_pb2.FieldDescriptorProto.TYPE_INT32),
+            ("Bid", descriptor_pb2.FieldDescriptorProto.TYPE_DOUBLE),
+            ("Ask", descriptor_pb2.FieldDescriptorProto.TYPE_DOUBLE),
+            ("Mid", descriptor_pb2.FieldDescriptorProto.TYPE_DOUBLE),
+        ],
+        start=1,
+    ):
+        message_proto.field.add(
+            name=name,
+            number=number,
+            type=field_type,
+            label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL,
+        )
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    descriptor = pool.FindMessageTypeByName(f"synthetic.{PROTOBUF_MESSAGE_NAME}")
+    if hasattr(message_factory, "GetMessageClass"):
+        return message_factory.GetMessageClass(descriptor)
+    return message_factory.MessageFactory(pool).GetPrototype(
+        descriptor
+    )  # protobuf < 4.21
+
+
+def protobuf_delta(rng: random.Random, uics: Sequence[int]) -> bytes:
+    """Encode a price in the protobuf wire format (Uic varint, Bid/Ask/Mid doubles)."""
+
+    uic = rng.choice(uics)
+    bid = rng.uniform(0.5, 2.0)
+    ask = bid + 0.0002
+    return (
+        b"\x08"
+        + _varint(uic)
+        + b"\x11"
+        + struct.pack("<d", bid)
+        + b"\x19"
+        + struct.pack("<d", ask)
+        + b"\x21"
+        + struct.pack("<d", (bid + ask) / 2)
+    )
+
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def generate_ref_ids(rng: random.Random, count: int) -> List[str]:
+    """Reference ids of varying length, like the ones generated by the samples."""
+
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_"
+    # reference ids starting with "_" are control messages
+    first = alphabet.replace("_", "")
+    return [
+        rng.choice(first)
+        + "".join(rng.choice(alphabet) for _ in range(rng.randint(2, 39)))
+        for _ in range(count)
+    ]
+
+
+def generate_messages(
+    count: int,
+    max_frames_per_message: int = 20,
+    ref_ids: Optional[Sequence[str]] = None,
+    protobuf_ref_ids: Sequence[str] = (),
+    heartbeat_ratio: float = 0.05,
+    uics: Sequence[int] = tuple(range(1, 1001)),
+    seed: int = 42,
+) -> List[bytes]:
+    """Generate `count` messages, each with 1 to `max_frames_per_message` frames.
+
+    Frames for `protobuf_ref_ids` carry protobuf payloads, all other frames carry JSON
+    payloads.
+    """
+
+    rng = random.Random(seed)
+    if ref_ids is None:
+        ref_ids = generate_ref_ids(rng, 10)
+    all_ref_ids = list(ref_ids) + list(protobuf_ref_ids)
+    protobuf = set(protobuf_ref_ids)
+
+    messages = []
+    msg_id = 1
+    for _ in range(count):
+        frames = []
+        for _ in range(rng.randint(1, max_frames_per_message)):
+            if rng.random() < heartbeat_ratio:
+                frames.append(
+                    encode_frame(
+                        msg_id,
+                        "_heartbeat",
+                        heartbeat(rng.sample(all_ref_ids, min(2, len(all_ref_ids)))),
+                    )
+                )
+            else:
+                ref_id = rng.choice(all_ref_ids)
+                if ref_id in protobuf:
+                    frames.append(
+                        encode_frame(msg_id, ref_id, protobuf_delta(rng, uics), 1)
+                    )
+                else:
+                    frames.append(encode_frame(msg_id, ref_id, json_delta(rng, uics)))
+            msg_id += 1
+        messages.append(b"".join(frames))
+    return messages
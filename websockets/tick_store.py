@@ -0,0 +1,270 @@
+# tested in Python 3.6+
+# required packages: numpy (and pyarrow for Parquet segments)
+
+"""Columnar, append-only storage of the InfoPrice ticks of a stream.
+
+`TickWriter` is a sink that turns every delta with a quote into one row of four columns:
+
+- timestamp: `LastUpdated` of the delta (or the receive time), as datetime64[us]
+- uic: the instrument
+- bid, ask: the latest bid and ask of the instrument, carried forward from earlier
+  deltas when a delta only contains one of them (NaN until the first one is received)
+
+Rows are written into preallocated NumPy arrays of `chunk_size` rows, so no Python
+objects are kept per tick. A full chunk is handed to a background thread, which writes
+it to a new segment in `directory`:
+
+- "npz": `ticks-000001.npz`, one .npy array per column (load with `numpy.load`)
+- "parquet": `ticks-000001.parquet` (requires pyarrow)
+
+At most `max_pending` chunks wait to be written, so memory is bounded by
+`(max_pending + 1) * chunk_size` rows (28 bytes each) however long the stream runs. The
+writer never waits for the disk: when the disk can't keep up and a chunk is full while
+no chunk is free, its rows are dropped and counted in `dropped`. A partial chunk is
+also written `flush_interval` seconds after its first row (by a timer on the event
+loop), so it is not lost when the stream is quiet.
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from metrics import parse_timestamp
+from sinks import Sink, StreamMessage
+
+# timestamps are written as microseconds since the epoch, and stored as datetime64[us]
+COLUMNS = {
+    "timestamp": np.dtype("int64"),
+    "uic": np.dtype("int32"),
+    "bid": np.dtype("float64"),
+    "ask": np.dtype("float64"),
+}
+
+FORMATS = ("npz", "parquet")
+
+_SEGMENT_NAME = re.compile(r"^ticks-(\d+)\.(npz|parquet)$")
+
+
+class _Chunk:
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, size: int):
+        self.columns = {name: np.empty(size, dtype) for name, dtype in COLUMNS.items()}
+        self.rows = 0
+
+
+class TickWriter(Sink):
+    """Writes the bid and ask of every delta to columnar segments, see the module doc.
+
+    Only messages of subscription `ref_id` are written, unless `ref_id` is None.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        chunk_size: int = 65536,
+        format: str = "npz",
+        flush_interval: float = 60.0,
+        max_pending: int = 2,
+        ref_id: Optional[str] = None,
+    ):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}, not {format!r}")
+        if format == "parquet":
+            _import_pyarrow()
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.format = format
+        self.flush_interval = flush_interval
+        self.ref_id = ref_id
+        self.rows = 0
+        self.segments = 0
+        self.dropped = 0
+        # latest [bid, ask] per uic, to complete deltas that only contain one of them
+        self._quotes: Dict[int, List[float]] = {}
+        self._sequence = _last_segment(directory)
+
+        self._free: "queue.Queue[_Chunk]" = queue.Queue()
+        for _ in range(max_pending):
+            self._free.put(_Chunk(chunk_size))
+        self._chunk = _Chunk(chunk_size)
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="tick-writer")
+        self._loop = asyncio.get_event_loop()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def send(self, message: StreamMessage) -> None:
+        if self.ref_id is not None and message.ref_id != self.ref_id:
+            return
+        if not isinstance(message.data, list):
+            return
+
+        quotes = self._quotes
+        for item in message.data:
+            uic = item.get("Uic")
+            if uic is None:
+                continue
+            if item.get("__meta_deleted"):
+                quotes.pop(uic, None)
+                continue
+            quote = item.get("Quote")
+            if not quote or ("Bid" not in quote and "Ask" not in quote):
+                continue
+            current = quotes.get(uic)
+            if current is None:
+                current = quotes[uic] = [np.nan, np.nan]
+            current[0] = quote.get("Bid", current[0])
+            current[1] = quote.get("Ask", current[1])
+            last_updated = item.get("LastUpdated")
+            try:
+                timestamp = (
+                    parse_timestamp(last_updated) if last_updated else time.time()
+                )
+            except ValueError:
+                timestamp = time.time()
+            self._append(int(timestamp * 1e6), uic, current[0], current[1])
+
+    def flush(self) -> None:
+        """Hand the rows written so far to the writer thread, as a new segment.
+
+        Never waits: when no chunk is free, a partial chunk keeps filling up, and the
+        rows of a full chunk are dropped.
+        """
+
+        self._cancel_timer()
+        chunk = self._chunk
+        if not chunk.rows:
+            return
+        try:
+            self._chunk = self._free.get_nowait()
+        except queue.Empty:
+            if chunk.rows == self.chunk_size:
+                logging.warning(
+                    f"writing ticks to {self.directory} can't keep up, "
+                    f"dropping {chunk.rows} ticks"
+                )
+                self.dropped += chunk.rows
+                chunk.rows = 0
+            return
+        self._submit(chunk)
+
+    def close(self) -> None:
+        """Write the remaining rows and wait until all segments are written."""
+
+        self._cancel_timer()
+        if self._chunk.rows:
+            self._submit(self._chunk)
+        self._executor.shutdown(wait=True)
+
+    def _append(self, timestamp: int, uic: int, bid: float, ask: float) -> None:
+        chunk = self._chunk
+        row = chunk.rows
+        columns = chunk.columns
+        columns["timestamp"][row] = timestamp
+        columns["uic"][row] = uic
+        columns["bid"][row] = bid
+        columns["ask"][row] = ask
+        chunk.rows = row + 1
+        self.rows += 1
+        if chunk.rows == self.chunk_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self.flush_interval, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self.flush()
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _submit(self, chunk: _Chunk) -> None:
+        self._sequence += 1
+        path = os.path.join(self.directory, f"ticks-{self._sequence:06d}.{self.format}")
+        self._executor.submit(self._write, chunk, path)
+
+    def _write(self, chunk: _Chunk, path: str) -> None:
+        try:
+            columns = {
+                name: column[: chunk.rows] for name, column in chunk.columns.items()
+            }
+            columns["timestamp"] = columns["timestamp"].view("datetime64[us]")
+            # readers never see a partially written segment
+            temporary_path = path + ".tmp"
+            if self.format == "npz":
+                with open(temporary_path, "wb") as segment_file:
+                    np.savez(segment_file, **columns)
+            else:
+                pyarrow, parquet = _import_pyarrow()
+                parquet.write_table(
+                    pyarrow.table(columns), temporary_path, compression="snappy"
+                )
+            os.replace(temporary_path, path)
+            self.segments += 1
+            logging.debug(f"wrote {chunk.rows} ticks to {path}")
+        except Exception:
+            logging.exception(f"could not write ticks to {path}")
+        finally:
+            chunk.rows = 0
+            self._free.put(chunk)
+
+
+def read_ticks(directory: str) -> Dict[str, Any]:
+    """Load all segments in `directory`, in the order they were written, per column."""
+
+    segments: Dict[str, List[Any]] = {name: [] for name in COLUMNS}
+    names = sorted(
+        (int(match.group(1)), name)
+        for name, match in (
+            (name, _SEGMENT_NAME.match(name)) for name in os.listdir(directory)
+        )
+        if match
+    )
+    for _, name in names:
+        path = os.path.join(directory, name)
+        if name.endswith(".npz"):
+            with np.load(path) as segment:
+                for column in COLUMNS:
+                    segments[column].append(segment[column])
+        else:
+            _, parquet = _import_pyarrow()
+            table = parquet.read_table(path)
+            for column in COLUMNS:
+                segments[column].append(table.column(column).to_numpy())
+
+    columns = {
+        name: np.concatenate(arrays) if arrays else np.empty(0, COLUMNS[name])
+        for name, arrays in segments.items()
+    }
+    columns["timestamp"] = columns["timestamp"].view("datetime64[us]")
+    return columns
+
+
+def _last_segment(directory: str) -> int:
+    """Sequence number of the last segment in `directory`, a new writer continues it."""
+
+    numbers = [
+        int(match.group(1))
+        for match in (_SEGMENT_NAME.match(name) for name in os.listdir(directory))
+        if match
+    ]
+    return max(numbers, default=0)
+
+
+def _import_pyarrow() -> Any:
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("the pyarrow package is required for Parquet segments")
+    return pyarrow, pyarrow.parquet
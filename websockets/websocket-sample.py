@@ -1,66 +1,61 @@
 # tested in Python 3.6+
 # required packages: websocket-client, requests
 
-import json
 import secrets
 from pprint import pprint
 
 import requests
 import websocket
 
+from capture import FrameRecorder
+from metrics import (
+    MESSAGE_BYTES_TOTAL,
+    MESSAGES_TOTAL,
+    InMemoryMetrics,
+    PrometheusExporter,
+)
+from payload_decoder import PayloadDecoder
+from router import MessageRouter, new_reference_id
+from sinks import PrintSink
+
 # copy your (24-hour) token here
 TOKEN = ""
 
 # create a random string for context ID and reference ID
 CONTEXT_ID = secrets.token_urlsafe(10)
-REF_ID = secrets.token_urlsafe(5)
+REF_ID = new_reference_id()
+
+# decoded messages are delivered to this sink - replace it with any sink from sinks.py
+SINK = PrintSink()
+
+# decodes JSON payloads, register a protobuf schema here to decode protobuf payloads
+DECODER = PayloadDecoder()
+
+# set to e.g. 8000 to record counters and histograms of the stream, and serve them in
+# the Prometheus text format on http://localhost:8000/metrics (recording costs speed)
+METRICS_PORT = None
+METRICS = InMemoryMetrics() if METRICS_PORT else None
 
+# heartbeats and other control messages are handled by the router, data goes to SINK
+ROUTER = MessageRouter(DECODER, metrics=METRICS)
+ROUTER.register(REF_ID, SINK.send)
 
-# when a new message is received the bytestring is parsed and payload is printed
-# see here for more details on the byte layout of message frames: https://www.developer.saxo/openapi/learn/plain-websocket-streaming
+# set to a file name to record all received messages, replay them with replay_capture.py
+CAPTURE_FILE = None
+RECORDER = FrameRecorder(CAPTURE_FILE) if CAPTURE_FILE else None
+
+
+# when a new message is received the bytestring is parsed and every frame is routed
+# see frame_parser.py for more details on the byte layout of message frames
 def on_message(ws, message):
-   index = 0
-   while index < len(message):
-        print(len(message));
-        # Message identifier (8 bytes)
-        # 64-bit little-endian unsigned integer identifying the message.
-        # The message identifier is used by clients when reconnecting. It may not be a sequence number and no interpretation
-        # of its meaning should be attempted at the client.
-        msg_id = int.from_bytes(message[index:index + 8], byteorder="little")
-        index += 8
-        # Version number (2 bytes)
-        # Ignored in this example. Get it using 'messageEnvelopeVersion = message.getInt16(index)'.
-        index += 2
-        # Reference id size 'Srefid' (1 byte)
-        # The number of characters/bytes in the reference id that follows.
-        ref_id_length = message[index]
-        index += 1
-        # Reference id (Srefid bytes)
-        # ASCII encoded reference id for identifying the subscription associated with the message.
-        # The reference id identifies the source subscription, or type of control message (like '_heartbeat').
-        ref_id = message[index : index + ref_id_length].decode()
-        index += ref_id_length
-        # Payload format (1 byte)
-        # 8-bit unsigned integer identifying the format of the message payload. Currently the following formats are defined:
-        #  0: The payload is a UTF-8 encoded text string containing JSON. Used for this sample.
-        #  1: The payload is a binary protobuffer message. See JavaScript repository for a Protobuf example.
-        # The format is selected when the client sets up a streaming subscription so the streaming connection may deliver a mixture of message format.
-        # Control messages such as subscription resets are not bound to a specific subscription and are always sent in JSON format.
-        payload_format = message[index]
-        if payload_format != 0:
-            print(f"An unsupported payload_format is sent by the server: {payload_format}!")
-        index += 1
-        # Payload size 'Spayload' (4 bytes)
-        # 64-bit little-endian unsigned integer indicating the size of the message payload.
-        payload_size = int.from_bytes(message[index : index + 4], byteorder="little")
-        index += 4
-        # Payload (Spayload bytes)
-        # Binary message payload with the size indicated by the payload size field.
-        # The interpretation of the payload depends on the message format field.
-        payload = message[index : index + payload_size].decode()
-        index += payload_size
-        print(f"Received message {msg_id}, for subscription {ref_id}, with payload:")
-        pprint(json.loads(payload))
+    if RECORDER is not None:
+        RECORDER.record(message)
+    if METRICS is not None:
+        METRICS.inc(MESSAGES_TOTAL)
+        METRICS.inc(MESSAGE_BYTES_TOTAL, len(message))
+    # route_message() yields the message id of every frame after it is routed
+    for _msg_id in ROUTER.route_message(message):
+        pass
 
 
 # handle incorrect token error
@@ -115,6 +110,9 @@ def on_close(ws):
     else:
         print("Error occurred while deleting subscription - closing websocket")
 
+    SINK.close()
+    if RECORDER is not None:
+        RECORDER.close()
     print("### websocket closed ###")
 
 
@@ -135,6 +133,15 @@ if __name__ == "__main__":
 
     take_primary_session()
 
+    exporter = None
+    if METRICS is not None:
+        try:
+            exporter = PrometheusExporter(METRICS, port=METRICS_PORT)
+        except OSError as error:
+            print(f"Could not serve metrics on port {METRICS_PORT}: {error}")
+        else:
+            exporter.start()
+
     # uncomment the below line to enable debugging output from websocket module
     # websocket.enableTrace(True)
     ws = websocket.WebSocketApp(
@@ -147,3 +154,5 @@ if __name__ == "__main__":
     )
 
     ws.run_forever()
+    if exporter is not None:
+        exporter.stop()
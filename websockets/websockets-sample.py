@@ -1,112 +1,190 @@
 # tested in Python 3.6+
-# required packages: websockets, requests
+# required packages: websockets, aiohttp (protobuf, grpcio-tools for protobuf payloads)
 
 import asyncio
-import json
 import secrets
 from pprint import pprint
 
-import requests
-import websockets
+from async_client import OpenAPIClient, OpenAPIError
+from batch_decoder import BatchDecoder
+from capture import FrameRecorder
+from conflation import ConflatingSink
+from metrics import InMemoryMetrics, PrometheusExporter
+from payload_decoder import PayloadDecoder
+from pipeline import OverflowPolicy, Pipeline
+from price_store import InfoPriceStore
+from reconnect import ReconnectingStreamer
+from router import MessageRouter
+from sinks import FanOutSink, PrintSink
+from subscription_manager import SubscriptionManager
 
 # copy your (24-hour) token here
 TOKEN = ""
 
-# create a random string for context ID and reference ID
+# create a random string for context ID
 CONTEXT_ID = secrets.token_urlsafe(10)
-REF_ID = secrets.token_urlsafe(5)
-
-
-def create_subscription(context_id, ref_id, token):
-    response = requests.post(
-        "https://gateway.saxobank.com/sim/openapi/trade/v1/infoprices/subscriptions",
-        headers={"Authorization": "Bearer " + token},
-        json={
-            "Arguments": {"Uics": "21, 22, 23", "AssetType": "FxSpot"},
-            "ContextId": context_id,
-            "ReferenceId": ref_id,
-        },
-    )
 
-    if response.status_code == 201:
-        print("Successfully created subscription")
-        print("Snapshot data:")
-        pprint(response.json()["Snapshot"])
-        print("Now receiving delta updates:")
-    elif response.status_code == 401:
-        print("Error setting up subscription - check TOKEN value")
-        exit()
-
-
-def decode_message(message):
-   index = 0
-   while index < len(message):
-        print(len(message));
-        # Message identifier (8 bytes)
-        # 64-bit little-endian unsigned integer identifying the message.
-        # The message identifier is used by clients when reconnecting. It may not be a sequence number and no interpretation
-        # of its meaning should be attempted at the client.
-        msg_id = int.from_bytes(message[index:index + 8], byteorder="little")
-        index += 8
-        # Version number (2 bytes)
-        # Ignored in this example. Get it using 'messageEnvelopeVersion = message.getInt16(index)'.
-        index += 2
-        # Reference id size 'Srefid' (1 byte)
-        # The number of characters/bytes in the reference id that follows.
-        ref_id_length = message[index]
-        index += 1
-        # Reference id (Srefid bytes)
-        # ASCII encoded reference id for identifying the subscription associated with the message.
-        # The reference id identifies the source subscription, or type of control message (like '_heartbeat').
-        ref_id = message[index : index + ref_id_length].decode()
-        index += ref_id_length
-        # Payload format (1 byte)
-        # 8-bit unsigned integer identifying the format of the message payload. Currently the following formats are defined:
-        #  0: The payload is a UTF-8 encoded text string containing JSON. Used for this sample.
-        #  1: The payload is a binary protobuffer message. See JavaScript repository for a Protobuf example.
-        # The format is selected when the client sets up a streaming subscription so the streaming connection may deliver a mixture of message format.
-        # Control messages such as subscription resets are not bound to a specific subscription and are always sent in JSON format.
-        payload_format = message[index]
-        if payload_format != 0:
-            print(f"An unsupported payload_format is sent by the server: {payload_format}!")
-        index += 1
-        # Payload size 'Spayload' (4 bytes)
-        # 64-bit little-endian unsigned integer indicating the size of the message payload.
-        payload_size = int.from_bytes(message[index : index + 4], byteorder="little")
-        index += 4
-        # Payload (Spayload bytes)
-        # Binary message payload with the size indicated by the payload size field.
-        # The interpretation of the payload depends on the message format field.
-        payload = message[index : index + payload_size].decode()
-        index += payload_size
-        print(f"Received message {msg_id}, for subscription {ref_id}, with payload:")
-        pprint(json.loads(payload))
-
-
-async def streamer(context_id, ref_id, token):
-    url = f"wss://streaming.saxobank.com/sim/openapi/streamingws/connect?contextId={context_id}"
-    headers = {"Authorization": f"Bearer {token}"}
-
-    async with websockets.connect(url, extra_headers=headers) as websocket:
-        async for message in websocket:
-            decode_message(message)
-
-
-# Only one app is entitled to receive realtime prices. This is handled via the primary session.
-# More info on keeping the status: https://saxobank.github.io/openapi-samples-js/websockets/primary-monitoring/
-def take_primary_session():
-    requests.put(
-        "https://gateway.saxobank.com/sim/openapi/root/v1/sessions/capabilities",
-        headers={"Authorization": "Bearer " + TOKEN},
-        json={"TradeLevel": "FullTradingAndChat"},
+# instruments to receive prices for - the subscription manager splits them over as many
+# subscriptions as needed
+UICS = [21, 22, 23]
+
+# decodes JSON payloads, and protobuf payloads when the manager uses
+# payload_format=FORMAT_PROTOBUF
+DECODER = PayloadDecoder()
+
+# keeps the latest quote per Uic, seeded from the snapshots and updated with every delta
+STORE = InfoPriceStore()
+
+# set to e.g. 8000 to record counters and histograms of the stream, and serve them in
+# the Prometheus text format on http://localhost:8000/metrics (recording costs speed)
+METRICS_PORT = None
+METRICS = InMemoryMetrics() if METRICS_PORT else None
+
+# set to e.g. 0.25 to pass on at most one update per instrument every 0.25 seconds,
+# with the deltas merged
+CONFLATION_INTERVAL = None
+
+# set to a file name to record all received messages, replay them with replay_capture.py
+CAPTURE_FILE = None
+
+# set to a directory to store the bid and ask of every delta in columnar segments
+# (requires numpy)
+TICKS_DIRECTORY = None
+
+# set to a name (e.g. "saxo_quotes") to publish the latest quotes to shared memory, so
+# other processes on this machine can read them with shared_quotes_reader.py instead of
+# opening their own connection (Python 3.8+)
+SHARED_QUOTES_NAME = None
+
+# set to e.g. 4 to spread the UICS over 4 connections (each with its own context id),
+# decoded in 4 worker processes, when a single connection can't keep up with the stream
+SHARDS = None
+
+
+def on_snapshot(subscription, snapshot):
+    STORE.apply(snapshot["Data"])
+    print(
+        f"Successfully created subscription {subscription.ref_id} "
+        f"for {len(subscription.uics)} instruments"
+    )
+    print("Snapshot data:")
+    pprint(snapshot)
+
+
+# the connection is re-established automatically when it drops, resuming from the last
+# received message
+# subscriptions only have to be created again when the server no longer holds them
+async def streamer(token, pipeline, manager, uics, recorder=None):
+    async def on_connected(resumed):
+        if not manager.subscriptions:
+            await manager.subscribe(uics, pipeline.send)
+            print("Now receiving delta updates:")
+        elif not resumed:
+            await manager.resubscribe_all()
+
+    connection = ReconnectingStreamer(
+        manager.context_id,
+        token,
+        manager.router,
+        on_connected,
+        pipeline=pipeline,
+        recorder=recorder,
     )
+    pipeline.start()
+    try:
+        await connection.run()
+    finally:
+        pipeline.close()
+        await manager.unsubscribe_all()
+
+
+# the supervisor restarts workers that exit, and passes their messages to the pipeline
+async def sharded_streamer(pipeline, supervisor):
+    pipeline.start()
+    try:
+        await supervisor.run()
+    finally:
+        pipeline.close()
 
 
 if __name__ == "__main__":
-    take_primary_session()
+    # replace the PrintSink with any other sink from sinks.py to process the messages
+    sinks = [STORE, PrintSink()]
+    if TICKS_DIRECTORY:
+        from tick_store import TickWriter
+
+        sinks.append(TickWriter(TICKS_DIRECTORY))
+    shared_quotes = None
+    if SHARED_QUOTES_NAME:
+        from shared_quotes import SharedQuoteWriter
+
+        # publishes every update of STORE, a block left behind by a previous run that
+        # crashed is replaced
+        shared_quotes = SharedQuoteWriter(SHARED_QUOTES_NAME, STORE, replace=True)
+    sink = FanOutSink(*sinks)
+    if CONFLATION_INTERVAL:
+        sink = ConflatingSink(sink, CONFLATION_INTERVAL, metrics=METRICS)
+    # the sink is called from a queue, so a slow sink does not hold up the websocket
+    # with OverflowPolicy.CONFLATE only the latest quote per Uic is kept while it lags
+    pipeline = Pipeline(sink.send, policy=OverflowPolicy.BLOCK, metrics=METRICS)
+    recorder = FrameRecorder(CAPTURE_FILE) if CAPTURE_FILE else None
+    client = OpenAPIClient(TOKEN)
+    exporter = None
+    if METRICS is not None:
+        try:
+            exporter = PrometheusExporter(METRICS, port=METRICS_PORT)
+        except OSError as error:
+            print(f"Could not serve metrics on port {METRICS_PORT}: {error}")
+        else:
+            exporter.start()
+
+    # heartbeats and other control messages are handled by the router, data goes to sink
+    # only the subscriptions reset by the server (_resetsubscriptions) are created again
+    # all frames of a websocket message are decoded at once, with orjson when installed
+    router = MessageRouter(
+        DECODER,
+        lambda ref_ids: manager.reset(ref_ids),
+        metrics=METRICS,
+        batch_decoder=BatchDecoder(DECODER),
+    )
+    manager = SubscriptionManager(client, CONTEXT_ID, router, on_snapshot=on_snapshot)
+    if SHARDS:
+        from sharded import ShardedStreamer
+
+        # the workers stop reading their connections while the pipeline is full
+        supervisor = ShardedStreamer(
+            TOKEN,
+            UICS,
+            pipeline.send,
+            SHARDS,
+            on_snapshot=on_snapshot,
+            metrics=METRICS,
+            pipeline=pipeline,
+        )
+
+    loop = asyncio.get_event_loop()
     try:
-        create_subscription(CONTEXT_ID, REF_ID, TOKEN)
-        asyncio.get_event_loop().run_until_complete(streamer(CONTEXT_ID, REF_ID, TOKEN))
+        loop.run_until_complete(client.take_primary_session())
+        if SHARDS:
+            loop.run_until_complete(sharded_streamer(pipeline, supervisor))
+        else:
+            loop.run_until_complete(streamer(TOKEN, pipeline, manager, UICS, recorder))
+    except OpenAPIError as error:
+        if error.status != 401:
+            raise
+        print("Error setting up subscription - check TOKEN value")
     except KeyboardInterrupt:
         print("User interrupted the interpreter - closing connection.")
-        exit()
+        if SHARDS:
+            loop.run_until_complete(supervisor.stop())
+        else:
+            loop.run_until_complete(manager.unsubscribe_all())
+    finally:
+        loop.run_until_complete(client.close())
+        sink.close()
+        if shared_quotes is not None:
+            shared_quotes.close()
+        if exporter is not None:
+            exporter.stop()
+        if recorder is not None:
+            recorder.close()